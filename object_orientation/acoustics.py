@@ -1,15 +1,53 @@
 import math
 import ctypes
-from picosdk.functions import adc2mV, assert_pico_ok
 import numpy as np
-from scipy import signal, fft
 import csv
 import os
+import sys
+import threading
+import time
 from datetime import date
+import sig_proc
+import fir
+from capture import Capture
+import capture_file
+from ring_buffer import RingBuffer
 
-import matplotlib
-matplotlib.use('TkAgg')
-import matplotlib.pyplot as plt
+# matplotlib, scipy and picosdk are imported on first use, a capture only needs numpy.
+# Headless plots go to files through Agg and never load Tk, set ACOUSTICS_HEADLESS=1
+# to force it. It is the default on Linux without a display.
+HEADLESS = os.environ.get("ACOUSTICS_HEADLESS", "0") != "0" or \
+        (sys.platform.startswith("linux") and not os.environ.get("DISPLAY") and not os.environ.get("WAYLAND_DISPLAY"))
+
+PICO_OK = 0
+
+# Channel ranges in mV, indexed by the PS4000a/PS2000a range enums
+CHANNEL_RANGES_MV = [10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000, 100000, 200000]
+
+# Downsampling modes, the same PS4000A/PS2000A_RATIO_MODE values on both drivers
+RATIO_MODES = {"none": 0, "aggregate": 1, "decimate": 2, "average": 4}
+
+def pyplot():
+    ''' matplotlib.pyplot, set up with TkAgg or Agg when headless on the first call. '''
+
+    if "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg' if HEADLESS else 'TkAgg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def new_figure():
+    ''' A matplotlib Figure that is not managed by pyplot, safe to draw and save off the main thread. '''
+
+    from matplotlib.figure import Figure
+    return Figure()
+
+def assert_pico_ok(status):
+    ''' Raises picosdk's error for a failed status, picosdk is only imported then. '''
+
+    if status != PICO_OK:
+        from picosdk.functions import assert_pico_ok as check
+        check(status)
 
 class Acoustics:
 
@@ -25,36 +63,309 @@ class Acoustics:
         self.delta_x = delta_x
         self.delta_z = delta_z
         self.delta_t = 0;
+        self.weighting = "plain" # GCC weighting used by print_toda, phat/scot also whiten the noise only bins
+        self.ping_detect = 0.025 # volts
+        self.noise_length = 100 # samples below ping_detect that end a ping
+        self.crop_to_ping = False # analyze only ping_window() instead of the whole capture
+        self.band = sig_proc.PINGER_BAND # (low, high) Hz searched by dominant_frequencies, None for the full spectrum
+        self.filter_band = None # (low, high) Hz FIR bandpass before ping detection and analysis, None for no filter
 
         self.ready = ctypes.c_int16(0)
         self.check = ctypes.c_int16(0)
+        self.block_ready = threading.Event() # set by block_ready_callback()
+        self.block_status = None
+        self.arm_generation = 0 # counts arms, passed to the driver as pParameter, see start_arm()
+        self.ready_listener = None # extra completion hook, used by capture()
+        self.num_captures = 1 # segments per block, see run_rapid()
+        self.rapid_maxes = None
         self.overflow = ctypes.c_int16() # create overflow location
         self.C_MAX_SAMPLES = ctypes.c_int32(self.MAX_SAMPLES) # create converted type maxSamples
 
         self.channels = []
-        self.buffer_maxes = []
-        self.buffer_mins = []
         for i in range(0, num_channels):
             self.channels.append([])
-            self.buffer_maxes.append( (ctypes.c_int16 * self.MAX_SAMPLES)() )
-            self.buffer_mins.append( (ctypes.c_int16 * self.MAX_SAMPLES)() )
+        # One contiguous block registered with the driver, row i is channel i
+        self.buffer_maxes = np.zeros((num_channels, self.MAX_SAMPLES), dtype = np.int16)
+        self.buffer_mins = None # only needed for aggregate downsampling
+        self._adc_2mV_maxes = np.zeros((num_channels, self.MAX_SAMPLES), dtype = np.float32) # last_capture()'s mV
+        self._last_capture = None # made on first use after each run
+        self._filtered = None # (filter_band, filtered_mV()) of the current run
+        # Downsampling of the last transferred samples, set by get_values(), see run_coarse()
+        self.run_ratio_mode = None
+        self.run_ratio = None
+        self.run_interval_ns = None
+        self.run_trigger_index = None
 
     def initialize(self, trigger_channel = 0, sample_length = 0.1, threshold = 0.5, auto_trigger = 0, delay = 0):
         '''Sets up the physical PicoScope interface.'''
 
         self.open_unit()
+        self.configure(trigger_channel, sample_length, threshold, auto_trigger, delay)
+
+    def configure(self, trigger_channel = 0, sample_length = 0.1, threshold = 0.5, auto_trigger = 0, delay = 0):
+        '''Applies new capture settings to an open PicoScope.
+
+        Same parameters as initialize, without reopening the unit.'''
+
         self.open_channels()
         self.set_sample_length(sample_length)
         self.set_trigger(trigger_channel, threshold, auto_trigger, delay)
         self.buffers()
+        # Only once the driver took them, capture_header() reports these
+        self.settings = {"trigger_channel": trigger_channel, "sample_length": sample_length, \
+                "threshold": threshold, "auto_trigger": auto_trigger, "delay": delay}
+
+    def run(self, run_name, timeout = None):
+        '''Collects samples from the PicoScope.
 
-    def run(self, run_name):
-        '''Collects samples from the PicoScope.'''
+        Returns the run as a Capture, see last_capture().'''
 
         self.run_name = run_name
-        self.block()
+        self.block(timeout)
         self.values_call()
         self.get_values()
+        return self.last_capture()
+
+    def run_rapid(self, run_name, captures, timeout = None):
+        '''Collects a burst of captures in rapid block mode.
+
+        Scope memory is split into one segment per capture, all of them are
+        armed back to back and then pulled in a single bulk transfer into
+        rapid_maxes (captures x channels x samples). Use load_segment() to
+        analyze one of them.'''
+
+        self.run_name = run_name
+        self.num_captures = captures
+        shape = (captures, len(self.channels), self.MAX_SAMPLES)
+        if self.rapid_maxes is None or self.rapid_maxes.shape != shape:
+            self.rapid_maxes = np.zeros(shape, dtype = np.int16)
+            self.rapid_overflow = (ctypes.c_int16 * captures)()
+        try:
+            self.segments(captures)
+            self.segment_buffers()
+            self.block(timeout)
+            self.values_bulk_call()
+        finally:
+            # Back to a single segment so run() works again
+            self.num_captures = 1
+            self.segments(1)
+            self.buffers()
+
+    def set_downsampling(self, mode = "none", ratio = 1):
+        '''Sets how the scope downsamples data on transfer.
+
+        Parameters:
+            mode: "none", "aggregate" (min and max of each group, the mins
+                go to buffer_mins), "decimate" or "average"
+            ratio: raw samples per transferred sample
+        '''
+        self.MODE = RATIO_MODES[mode]
+        self.DOWNSAMPLE_RATIO_MODE = RATIO_MODES[mode]
+        self.DOWNSAMPLE_RATIO = ratio if mode != "none" else 0
+        if mode == "aggregate" and self.buffer_mins is None:
+            self.buffer_mins = np.zeros_like(self.buffer_maxes)
+        self.buffers()
+
+    def downsample_ratio(self):
+        ''' Raw samples per transferred sample. '''
+        return self.DOWNSAMPLE_RATIO if self.DOWNSAMPLE_RATIO_MODE != RATIO_MODES["none"] else 1
+
+    def sample_interval_ns(self):
+        ''' Time between transferred samples, including downsampling. '''
+        return self.time_interval_ns.value * self.downsample_ratio()
+
+    def run_coarse(self, run_name, ratio = 64, threshold = None, timeout = None):
+        '''Collects samples, only transferring full rate data when there is a ping.
+
+        A min/max aggregate overview of the block is pulled first. If any
+        channel goes past threshold (volts, defaults to ping_detect) the
+        full rate samples are pulled from scope memory as well, otherwise
+        buffer_maxes and buffer_mins keep the overview. The downsampling set
+        before the call is restored afterwards, the run_ attributes, the
+        capture header and the analysis keep the sample interval and ratio
+        of what was transferred.
+
+        Returns True if the full rate samples were transferred.'''
+
+        if threshold is None:
+            threshold = self.ping_detect
+        limit = threshold * 1000 / CHANNEL_RANGES_MV[self.RANGE] * self.MAX_ADC.value
+
+        self.run_name = run_name
+        saved = (self.MODE, self.DOWNSAMPLE_RATIO_MODE, self.DOWNSAMPLE_RATIO)
+        try:
+            self.set_downsampling("aggregate", ratio)
+            self.block(timeout)
+            self.values_call()
+            self.get_values()
+            count = self.C_MAX_SAMPLES.value
+            ping = np.abs(self.buffer_maxes[:, :count]).max() > limit or \
+                    np.abs(self.buffer_mins[:, :count].astype(np.int32)).max() > limit
+
+            if ping:
+                self.set_downsampling("none")
+                self.values_call()
+                self.get_values()
+        finally:
+            # Later runs get the downsampling that was set before
+            self.MODE, self.DOWNSAMPLE_RATIO_MODE, self.DOWNSAMPLE_RATIO = saved
+            self.buffers()
+        return ping
+
+    def load_segment(self, segment, run_name = None):
+        ''' Makes one rapid block capture the current run. '''
+
+        self.run_name = run_name if run_name is not None else self.run_name + "_" + str(segment)
+        self.buffer_maxes[:] = self.rapid_maxes[segment]
+        self.overflow.value = self.rapid_overflow[segment]
+        self.get_values()
+
+    def start_streaming(self, sample_interval_ns, ring_samples, chunk_samples = 50000):
+        '''Starts gap free streaming into a ring buffer.
+
+        Parameters:
+            sample_interval_ns: requested sample interval, the driver may round it
+            ring_samples: samples kept per channel
+            chunk_samples: size of the driver's transfer buffers
+
+        Call poll_streaming() regularly to move samples into the ring and
+        stream_pings() to collect the pings found in it. With filter_band
+        set the stream is bandpassed as it is scanned for pings.'''
+
+        self.ring = RingBuffer(len(self.channels), ring_samples)
+        self.stream_buffers = np.zeros((len(self.channels), chunk_samples), dtype = np.int16)
+        self.block_interval_ns = self.time_interval_ns.value # run_streaming replaces it, see stop_streaming()
+        self.streaming_buffers()
+        self.run_streaming(sample_interval_ns)
+        self.stream_filter = None
+        if self.filter_band is not None:
+            self.stream_filter = fir.OverlapSave(fir.design(self.sample_interval_ns() * 1e-9, tuple(self.filter_band)), \
+                    len(self.channels))
+        self.restart_stream_scan(0)
+
+    def restart_stream_scan(self, position):
+        ''' Starts looking for pings afresh at sample position, after samples were lost. '''
+
+        threshold = self.ping_detect * 1000 / CHANNEL_RANGES_MV[self.RANGE] * self.MAX_ADC.value
+        self.stream_tracker = sig_proc.PingTracker(threshold, self.noise_length) # counts
+        self.stream_origin = position # ring position of the tracker's sample 0
+        self.stream_scanned = position
+        self.stream_pending = [] # pings waiting for the samples after them
+        if self.stream_filter is not None:
+            self.stream_filter.reset()
+
+    def poll_streaming(self):
+        ''' Copies the samples the driver has ready into the ring.
+            Returns how many were copied. '''
+
+        before = self.ring.written
+        self.streaming_latest_values()
+        return self.ring.written - before
+
+    def streaming_callback(self, handle, no_of_samples, start_index, overflow, trigger_at, \
+            triggered, auto_stop, p_parameter):
+        ''' StreamingReady callback, called by the driver inside streaming_latest_values(). '''
+        self.ring.write(self.stream_buffers[:, start_index:start_index + no_of_samples], overflow)
+
+    def stream_pings(self):
+        '''Finds the pings completed in the ring since the last call.
+
+        Returns a list of (start, end, window). start and end are absolute
+        sample positions, window is the int16 counts of all channels from
+        start to end padded by max_lag() on both sides, unfiltered. Pings
+        that are still running are returned by a later call.'''
+
+        pad = self.max_lag() or 0
+        written = self.ring.written
+        if self.stream_scanned < self.ring.oldest():
+            self.restart_stream_scan(self.ring.oldest())
+        block = self.ring.window(self.stream_scanned, written)
+        self.stream_scanned = written
+        # The filter output lags by delay, shift the pings back onto the ring positions
+        delay = 0
+        if self.stream_filter is not None:
+            block = self.stream_filter.process(block)
+            delay = self.stream_filter.delay
+        offset = self.stream_origin - delay
+
+        # One envelope for all channels so every ping gets one shared window
+        for start, end in self.stream_tracker.update(np.abs(block).max(axis = 0)):
+            self.stream_pending.append((max(start + offset, self.stream_origin), end + offset))
+        found = []
+        while self.stream_pending and self.stream_pending[0][1] + pad <= written:
+            start, end = self.stream_pending.pop(0)
+            oldest = self.ring.oldest()
+            if end + pad > oldest:
+                found.append((start, end, self.ring.window(max(start - pad, oldest), end + pad)))
+
+        # Keep the samples a ping waiting for its window, or still running, will need
+        keep = written
+        if self.stream_pending:
+            keep = self.stream_pending[0][0] - pad
+        elif self.stream_tracker.start is not None:
+            keep = self.stream_tracker.start + offset - pad
+        self.ring.advance(max(keep, 0))
+        return found
+
+    def stop_streaming(self):
+        ''' Stops streaming, registers the block buffers and restores the block sample interval. '''
+
+        self.stop()
+        self.time_interval_ns.value = self.block_interval_ns
+        self.buffers()
+
+    async def capture(self, run_name, timeout = None):
+        '''Collects samples without blocking the event loop.
+
+        Only one capture per scope may be awaited at a time.
+        Returns a Capture of the run.'''
+
+        import asyncio
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def ready():
+            if not done.done():
+                done.set_result(None)
+
+        self.run_name = run_name
+        self.ready_listener = lambda: loop.call_soon_threadsafe(ready)
+        try:
+            self.arm()
+            await asyncio.wait_for(done, timeout)
+        except asyncio.TimeoutError:
+            self.abandon_arm()
+            raise TimeoutError("PicoScope block capture not ready after " + str(timeout) + " s")
+        finally:
+            self.ready_listener = None
+        assert_pico_ok(self.block_status)
+        self.ready.value = 1
+
+        # The transfer and conversion block, keep them off the event loop
+        await loop.run_in_executor(None, self.values_call)
+        await loop.run_in_executor(None, self.get_values)
+        return self.last_capture()
+
+    def get_capture(self):
+        ''' Returns a new Capture of the last run.
+
+        It borrows buffer_maxes and converts to mV into the preallocated
+        mV buffer, the next run overwrites both. Use Capture.copy() to
+        keep it. '''
+
+        count = self.C_MAX_SAMPLES.value
+        return Capture(getattr(self, "run_name", None), self.buffer_maxes[:, :count], None, \
+                self.run_interval_ns, self.run_trigger_index, self.overflow.value, \
+                CHANNEL_RANGES_MV[self.RANGE] / self.MAX_ADC.value, self._adc_2mV_maxes[:, :count])
+
+    def last_capture(self):
+        ''' The Capture of the last run, made once per run.
+
+        The analysis methods share its time axis and spectra. '''
+
+        if self._last_capture is None:
+            self._last_capture = self.get_capture()
+        return self._last_capture
 
     def end(self):
         ''' Properly shuts down and disconnects the PicoScope. '''
@@ -68,72 +379,116 @@ class Acoustics:
         return c
 
     def get_time(self):
-        ''' Returns the linearly spaced time.
+        ''' Returns the sample times in ns.
             Only works properly after run(). '''
 
-        return np.linspace(0, (self.C_MAX_SAMPLES.value) * self.time_interval_ns.value, self.C_MAX_SAMPLES.value)
+        return self.last_capture().get_time()
 
     def plot_time(self):
         ''' Creates a plot for all channels.
             Used by show_plot() and write_plot(). '''
 
-        time = self.get_time()
-        if len(self.adc_2mV_maxes) > 1:
-            fig, axs = plt.subplots(len(self.adc_2mV_maxes))
-            for i in range(0, len(self.adc_2mV_maxes)):
-                axs[i].plot(time, self.adc_2mV_maxes[i][:])
-                axs[i].title.set_text("Channel " + str(i))
-            fig.tight_layout()
-        else:
-            plt.plot(time, self.adc_2mV_maxes[0][:])
-            plt.title.set_text("Time")
-        plt.xlabel('Time (ns)')
-        plt.ylabel('Voltage (mV)')
+        return self.time_figure(pyplot().figure())
 
     def plot_freq(self):
         ''' Creates a plot for all channels.
             Used by show_plot() and write_plot(). '''
 
-        time = self.get_time()
-        if len(self.adc_2mV_maxes) > 1:
-            fig, axs = plt.subplots(len(self.adc_2mV_maxes))
-            for i in range(0, len(self.adc_2mV_maxes)):
-                Y = np.fft.fft(self.adc_2mV_maxes[i])
-                freq = np.fft.fftfreq(len(self.adc_2mV_maxes[i]), (time[1] - time[0]) * 1e-9)
-                axs[i].plot(freq, np.abs(Y))
+        return self.freq_figure(pyplot().figure())
+
+    def time_figure(self, fig = None):
+        ''' Draws every channel against time into fig, a new Figure outside
+            pyplot by default so it can be saved from another thread. '''
+
+        fig = fig if fig is not None else new_figure()
+        # The Capture does not change, so the figure can be saved after the next run
+        capture = self.last_capture()
+        axs = fig.subplots(len(capture.adc_2mV), squeeze = False)[:, 0]
+        for i in range(0, len(capture.adc_2mV)):
+            axs[i].plot(capture.time, capture.adc_2mV[i])
+            axs[i].title.set_text("Channel " + str(i) if len(axs) > 1 else "Time")
+        axs[-1].set_xlabel('Time (ns)')
+        axs[-1].set_ylabel('Voltage (mV)')
+        fig.tight_layout()
+        return fig
+
+    def freq_figure(self, fig = None):
+        ''' Draws the spectrum of every analysis channel into fig, see time_figure. '''
+
+        fig = fig if fig is not None else new_figure()
+        freq, Y, magnitude = self.spectra()
+        if len(Y) > 1:
+            axs = fig.subplots(len(Y))
+            for i in range(0, len(Y)):
+                axs[i].plot(freq, magnitude[i])
                 axs[i].title.set_text("Channel " + str(i))
-            fig.tight_layout()
         else:
-            fig, axs = plt.subplots(2)
-            Y = np.fft.fft(self.adc_2mV_maxes[0])
-            freq = np.fft.fftfreq(len(self.adc_2mV_maxes[0]), (time[1] - time[0]) * 1e-9)
-            axs[0].plot(freq, np.abs(Y))
+            axs = fig.subplots(2)
+            axs[0].plot(freq, magnitude[0])
             axs[0].title.set_text("Magnitude")
-            axs[1].plot(freq, np.angle(Y))
+            axs[1].plot(freq, np.angle(Y[0]))
             axs[1].title.set_text("Phase")
-            fig.tight_layout()
-        plt.xlabel('Frequency (Hz)')
-        plt.ylabel('Magnitude')
+        axs[-1].set_xlabel('Frequency (Hz)')
+        axs[-1].set_ylabel('Magnitude')
+        fig.tight_layout()
+        return fig
 
     def show_plot(self):
-        ''' Displays a plot in an X11 frame. '''
-        plt.show()
+        ''' Displays a plot in an X11 frame, headless it is discarded. '''
+        if HEADLESS:
+            pyplot().close()
+        else:
+            pyplot().show()
 
-    def write_plot(self, typename = ""):
-        ''' Writes a plot image to a png. '''
+    def output_path(self, suffix):
+        ''' Path of an output file for the current run, in a folder named by today's date. '''
         if not os.path.exists(str(date.today())):
             os.mkdir(str(date.today()))
-        plt.savefig(str(date.today()) + "/" + str(self.run_name) + "_" + str(typename) + ".png")
+        return str(date.today()) + "/" + str(self.run_name) + suffix
+
+    def write_plot(self, typename = ""):
+        ''' Writes a plot image to a png. '''
+        pyplot().savefig(self.output_path("_" + str(typename) + ".png"))
+
+    def capture_header(self):
+        ''' Metadata of the last run for a capture file, see capture_file. '''
+
+        return {
+            "run_name": str(self.run_name),
+            "model": type(self).__name__,
+            "channels": list(range(0, len(self.channels))), # file row -> scope channel
+            "time_interval_ns": self.run_interval_ns,
+            "trigger_index": self.run_trigger_index,
+            "range": self.RANGE,
+            "range_mV": CHANNEL_RANGES_MV[self.RANGE],
+            "max_adc": self.MAX_ADC.value,
+            "mV_per_count": CHANNEL_RANGES_MV[self.RANGE] / self.MAX_ADC.value,
+            "overflow": self.overflow.value,
+            "downsample_ratio_mode": self.run_ratio_mode,
+            "downsample_ratio": self.run_ratio,
+            "settings": getattr(self, "settings", {}),
+            "timestamp": time.time(),
+        }
+
+    def write_capture(self):
+        ''' Writes the raw counts and their metadata as a binary capture file.
+
+        Returns the file path. Read it back with capture_file.read(). '''
+        path = self.output_path(capture_file.EXTENSION)
+        capture_file.write(path, self.buffer_maxes[:, :self.C_MAX_SAMPLES.value], self.capture_header())
+        return path
 
     def write_csv(self):
-        ''' Writes the data as a csv. '''
-        if not os.path.exists(str(date.today())):
-            os.mkdir(str(date.today()))
+        ''' Writes the data as a csv.
+
+        Slow and about ten times the size of write_capture(), for tools
+        that need text. '''
+        path = self.output_path(".csv")
         titles = ["time"]
         for i in range(0, len(self.adc_2mV_maxes)):
             titles.append("Channel_" + str(i))
 
-        with open(str(date.today()) + "/" + str(self.run_name) + ".csv", 'w') as f:
+        with open(path, 'w') as f:
             writer = csv.writer(f)
             writer.writerow(titles)
             time = self.get_time()
@@ -146,6 +501,7 @@ class Acoustics:
             returns dominant frequency of ping
         '''
 
+        from scipy import fft
         mag = np.abs(fft.rfft(channel)) # rfft - positive frequencies only
         f = fft.rfftfreq(mag.size, d=tstep) # frequency axis
 
@@ -153,55 +509,175 @@ class Acoustics:
 
         return f[findex]
 
+    def spectra(self):
+        ''' Frequency axis, rfft and magnitude of the analysis channels.
+
+        Without crop_to_ping these are last_capture()'s, computed once per run. '''
+
+        if not self.crop_to_ping:
+            capture = self.last_capture()
+            return capture.frequencies, capture.spectrum, capture.magnitude
+        from scipy import fft
+        channels = self.analysis_channels()
+        spectrum = fft.rfft(channels, axis = -1)
+        return fft.rfftfreq(channels.shape[-1], self.run_interval_ns * 1e-9), spectrum, np.abs(spectrum)
+
+    def dominant_frequencies(self):
+        ''' Dominant frequency of each analysis channel.
+
+        Searches only self.band with sig_proc.band_frequency, or the whole
+        spectrum when band is None. '''
+
+        if self.band is not None:
+            tstep = self.run_interval_ns * 1e-9
+            return [ float(f) for f in sig_proc.band_frequency(self.analysis_channels(), tstep, self.band) ]
+        freq, spectrum, magnitude = self.spectra()
+        return [ float(f) for f in freq[np.argmax(magnitude, axis = -1)] ]
+
     def print_fourier(self):
-        time = self.get_time()
-        step = ( (time[1] - time[0]) * 1e-9 ) * 2
+        ''' Prints and returns dominant_frequencies(). '''
+
+        frequencies = self.dominant_frequencies()
         print("\nDominant Frequencies:")
-        for i in range(0, len(self.buffer_maxes)):
-            print("\tChannel " + str(i) + ": " + str(self.fourier(self.adc_2mV_maxes[i], step)))
+        for i in range(0, len(frequencies)):
+            print("\tChannel " + str(i) + ": " + str(frequencies[i]))
         print("\n")
+        return frequencies
 
-    def time_difference(self, channel_one, channel_two):
+    def detect_pings(self, channels = None):
         '''
-            Convolutional function to determine the delta t value based on cross correlation
+            returns (start, end) sample intervals of every ping on each channel
         '''
-        cross_correlation = [0]
-
-        k = len(channel_one)
-        i = len(channel_two)
+        if channels is None:
+            channels = self.filtered_mV()
+        return sig_proc.detect_pings(channels, self.ping_detect * 1000, self.noise_length) # mV
 
-        for n in range(0, k + i - 1):
-            cross_correlation[n] = 0
-            for m in range(0,k - 1):
-                if(m + n - (k - 1) < 0):
-                    cross_correlation[n] = cross_correlation[n] + 0
-                else:
-                    cross_correlation[n] = cross_correlation[n] + (channel_two[m] * channel_one[n + m - (k - 1)])
-            cross_correlation.append(0)
+    def match_pings(self, detector = None, channels = None):
+        '''
+            returns the matched_filter.Detection of every ping on each
+            channel, found by detector, a matched_filter.MatchedFilter with
+            its default templates when None. Finds pings far below
+            ping_detect.
+        '''
+        if detector is None:
+            import matched_filter
+            detector = matched_filter.MatchedFilter()
+        if channels is None:
+            channels = self.adc_2mV_maxes
+        return detector.detect(channels, self.run_interval_ns * 1e-9)
+
+    def ping_window(self):
+        '''
+            returns a (start, end) sample window shared by all channels that
+            covers the ping at the trigger point, padded by max_lag()
+        '''
+        pad = self.max_lag() or 0
+        starts = []
+        ends = []
+        for pings in self.detect_pings():
+            # first ping that can belong to the trigger, another channel may hear it up to pad earlier
+            for start, end in pings:
+                if end >= self.run_trigger_index - pad:
+                    starts.append(start)
+                    ends.append(end)
+                    break
+        if len(starts) == 0:
+            return 0, len(self.adc_2mV_maxes[0])
+        return max(min(starts) - pad, 0), min(max(ends) + pad, len(self.adc_2mV_maxes[0]))
+
+    def filtered_mV(self):
+        '''
+            adc_2mV_maxes bandpassed to filter_band by fir.bandpass, filtered
+            once per run, or adc_2mV_maxes itself when filter_band is None
+        '''
+        if self.filter_band is None:
+            return self.adc_2mV_maxes
+        band = tuple(self.filter_band)
+        if self._filtered is None or self._filtered[0] != band:
+            self._filtered = (band, fir.bandpass(self.adc_2mV_maxes, self.run_interval_ns * 1e-9, band))
+        return self._filtered[1]
+
+    def analysis_channels(self):
+        '''
+            channels fed to the frequency and TDOA stages, cut to ping_window()
+            when crop_to_ping is set
+        '''
+        channels = np.asarray(self.filtered_mV())
+        if not self.crop_to_ping:
+            return channels
+        start, end = self.ping_window()
+        return channels[:, start:end]
 
-        return cross_correlation.index(max(cross_correlation)) # returns index NOT time 
+    def time_difference(self, channel_one, channel_two):
+        '''
+            Convolutional function to determine the delta t value based on cross correlation
+        '''
+        return self.time_difference_fft(channel_one, channel_two, "plain") # returns index NOT time
 
     def time_difference_2(self, channel_one, channel_two):
         # tdoa from scipy cross correlation function
-        # todo: try fft based cross correlation 
+        # time_difference_fft is the FFT based version
 
+        from scipy import signal
         cross_correlation = signal.correlate(channel_one, channel_two, mode='full', method='auto')
         return np.argmax(cross_correlation) # returns index NOT time
 
-    def toda_to_time(self, toda):
-        time = self.get_time()
-        step = (time[1] - time[0]) * 1e-9
-        return (toda - self.MAX_SAMPLES) * step
+    def max_lag(self):
+        ''' Largest possible delay in samples between hydrophones,
+            from the array spacing. None when the spacing is unset. '''
+
+        aperture = math.hypot(self.delta_x, self.delta_z)
+        if aperture == 0:
+            return None
+        return sig_proc.aperture_lag(aperture, self.run_interval_ns * 1e-9)
+
+    def time_difference_fft(self, channel_one, channel_two, weighting = None, max_lag = None):
+        '''
+            FFT based generalized cross correlation (plain, phat or scot weighting).
+            Only lags up to max_lag, or the array's max_lag(), are searched.
+        '''
+        if weighting is None:
+            weighting = self.weighting
+        if max_lag is None:
+            max_lag = self.max_lag()
+        return sig_proc.gcc(channel_one, channel_two, weighting, max_lag) # returns index NOT time
+
+    def toda_to_time(self, toda, length = None):
+        if length is None:
+            length = self.MAX_SAMPLES
+        step = self.run_interval_ns * 1e-9
+        return (toda - (length - 1)) * step # zero lag is at index length - 1
+
+    def time_difference_matrix(self, channels = None, weighting = None, max_lag = None):
+        '''
+            All-pairs TDOA, entry (i, j) is time_difference_fft(channels[i], channels[j]).
+            Each channel is only transformed once. Defaults to the last run's channels.
+        '''
+        if channels is None:
+            channels = self.adc_2mV_maxes
+        if weighting is None:
+            weighting = self.weighting
+        if max_lag is None:
+            max_lag = self.max_lag()
+        return sig_proc.gcc_matrix(channels, weighting, max_lag) # returns indices NOT time
+
+    def tdoa(self):
+        ''' All-pairs time differences in seconds over the analysis channels. '''
+
+        channels = self.analysis_channels()
+        return self.toda_to_time(self.time_difference_matrix(channels), len(channels[0]))
 
     def print_toda(self):
+        ''' Prints and returns tdoa(). '''
+
+        delays = self.tdoa()
         print("\nTODA Indices:")
-        for i in range(0, len(self.adc_2mV_maxes)):
-            for j in range(0, len(self.adc_2mV_maxes)):
+        for i in range(0, len(delays)):
+            for j in range(0, len(delays)):
                 if i != j:
-                    print( "\t" + str(i) + "-" + str(j) + ": " + str( \
-                            self.toda_to_time(self.time_difference_2(self.adc_2mV_maxes[i],\
-                            self.adc_2mV_maxes[j]) ) ) )
+                    print( "\t" + str(i) + "-" + str(j) + ": " + str(delays[i][j]) )
         print("\n")
+        return delays
 
     def pitch_yaw(self,C1,C2):
         arg1 = math.sqrt( (C1 + 1) / (C2 + C1 * C2) )
@@ -245,8 +721,10 @@ class Acoustics:
         Parameters:
             trigger_channel: The channel number to watch
             threshold: The minimum signal voltage to trigger
-            delay: milliseconds to delay after trigger
-            auto_trigger: milliseconds to trigger without passing threshold
+            delay: samples from the trigger to the start of the post
+                trigger samples, the driver counts it in sample periods
+            auto_trigger: milliseconds to trigger without passing threshold,
+                0 waits for the threshold
         '''
         raise NotImplementedError()
 
@@ -263,16 +741,113 @@ class Acoustics:
         '''Creates buffers to capture data.'''
         raise NotImplementedError()
 
-    def block(self):
+    def block(self, timeout = None):
+        ''' Runs one block capture and sleeps until the scope reports it is done. '''
+        self.arm()
+        self.wait_ready(timeout)
+
+    def block_ready_callback(self, handle, status, p_parameter):
+        ''' BlockReady callback, called from the driver's thread.
+
+        Ignores a late callback from an arm that timed out, p_parameter is
+        the arm_generation it was armed with. '''
+        if p_parameter != self.arm_generation:
+            return
+        self.block_status = status
+        self.block_ready.set()
+        if self.ready_listener is not None:
+            self.ready_listener()
+
+    def wait_ready(self, timeout = None):
+        '''Waits for the capture started by arm().
+
+        Parameters:
+            timeout: seconds to wait, None waits forever
+
+        Raises TimeoutError when the scope has not triggered in time.
+        '''
+        if not self.block_ready.wait(timeout):
+            self.abandon_arm()
+            raise TimeoutError("PicoScope block capture not ready after " + str(timeout) + " s")
+        assert_pico_ok(self.block_status)
+        self.ready.value = 1
+
+    def start_arm(self):
+        ''' Resets the completion state for a new arm and tags it with a new generation. '''
+
+        self.arm_generation += 1
+        self.P_PARAMETER = ctypes.c_void_p(self.arm_generation)
+        self.block_ready.clear()
+        self.ready.value = 0
+
+    def abandon_arm(self):
+        ''' Stops a capture that timed out, its BlockReady callback is then ignored. '''
+
+        self.arm_generation += 1
+        self.stop()
+
+    def arm(self):
+        '''Starts a block capture without waiting for it.
+
+        Returns the threading.Event set once the capture is complete.'''
         raise NotImplementedError()
 
     def values_call(self):
         raise NotImplementedError()
 
+    def segments(self, count):
+        '''Splits scope memory into count segments and captures count triggers per block.'''
+        raise NotImplementedError()
+
+    def segment_buffers(self):
+        '''Registers rapid_maxes with the driver, one buffer per segment and channel.'''
+        raise NotImplementedError()
+
+    def values_bulk_call(self):
+        '''Transfers every segment into rapid_maxes.'''
+        raise NotImplementedError()
+
     def get_values(self):
-        self.adc_2mV_maxes = []
-        for i in range(0, len(self.channels)):
-            self.adc_2mV_maxes.append(adc2mV(self.buffer_maxes[i], self.RANGE, self.MAX_ADC))
+        ''' Marks the captured counts as new, last_capture() converts them on first use.
+
+        Records the downsampling they were transferred with, later mode
+        changes do not relabel them. '''
+        self.run_ratio_mode = self.DOWNSAMPLE_RATIO_MODE
+        self.run_ratio = self.downsample_ratio()
+        self.run_interval_ns = self.sample_interval_ns()
+        # A trigger delay moves the capture later, the trigger sample comes earlier in it
+        self.run_trigger_index = (self.PRE_TRIGGER_SAMPLES - getattr(self, "settings", {}).get("delay", 0)) // self.run_ratio
+        self._last_capture = None
+        self._filtered = None
+
+    @property
+    def adc_2mV_maxes(self):
+        ''' The last run in mV, channels x samples float32, read only.
+
+        last_capture()'s adc_2mV, converted once per run with a single
+        vectorized scale into a preallocated array. '''
+        return self.last_capture().adc_2mV
+
+    def counts_to_mV(self, counts, out = None):
+        ''' Converts ADC counts to float32 mV for the channel range, into out if given. '''
+        scale = np.float32(CHANNEL_RANGES_MV[self.RANGE] / self.MAX_ADC.value)
+        return np.multiply(counts, scale, out = out, dtype = np.float32)
+
+    def trigger_time_offset(self):
+        '''Seconds from the trigger sample to the actual trigger event in the last capture.'''
+        raise NotImplementedError()
+
+    def streaming_buffers(self):
+        '''Registers stream_buffers with the driver.'''
+        raise NotImplementedError()
+
+    def run_streaming(self, sample_interval_ns):
+        '''Starts streaming without auto stop and stores the actual interval in time_interval_ns.'''
+        raise NotImplementedError()
+
+    def streaming_latest_values(self):
+        '''Asks the driver for new samples, delivered to streaming_callback().'''
+        raise NotImplementedError()
 
     def stop(self):
         ''' Stops the PicoScope. '''
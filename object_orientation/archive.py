@@ -0,0 +1,207 @@
+import glob
+import os
+import sqlite3
+import numpy as np
+import capture_file
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    run_name TEXT,
+    timestamp REAL,
+    model TEXT,
+    num_channels INTEGER,
+    samples INTEGER,
+    time_interval_ns REAL,
+    range INTEGER,
+    range_mV REAL,
+    downsample_ratio INTEGER,
+    trigger_channel INTEGER,
+    threshold REAL,
+    auto_trigger INTEGER,
+    delay INTEGER,
+    sample_length REAL,
+    overflow INTEGER
+);
+CREATE TABLE IF NOT EXISTS channels (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    channel INTEGER NOT NULL,
+    frequency REAL,
+    overflow INTEGER,
+    PRIMARY KEY (run_id, channel)
+);
+CREATE TABLE IF NOT EXISTS tdoa (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    channel_one INTEGER NOT NULL,
+    channel_two INTEGER NOT NULL,
+    seconds REAL,
+    PRIMARY KEY (run_id, channel_one, channel_two)
+);
+CREATE INDEX IF NOT EXISTS runs_run_name ON runs(run_name);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs(timestamp);
+CREATE INDEX IF NOT EXISTS runs_trigger ON runs(trigger_channel, threshold);
+CREATE INDEX IF NOT EXISTS channels_frequency ON channels(frequency);
+'''
+
+# Settings from the capture header "settings" that get their own column
+SETTING_COLUMNS = ("trigger_channel", "threshold", "auto_trigger", "delay", "sample_length")
+RUN_COLUMNS = ("run_name", "timestamp", "model", "num_channels", "samples", "time_interval_ns", "range", \
+        "range_mV", "downsample_ratio") + SETTING_COLUMNS + ("overflow",)
+
+class Archive:
+    ''' SQLite index of capture files.
+
+    Every run is one row pointing at its capture file, with the scope
+    settings, per channel dominant frequency and overflow, and the
+    all-pairs TDOA. Queries only touch the index, the samples are memory
+    mapped from the capture files when loaded. '''
+
+    def __init__(self, path = "archive.sqlite"):
+        self.connection = sqlite3.connect(path)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def add(self, path, header = None, frequencies = None, tdoa = None):
+        ''' Indexes a capture file, replacing an earlier entry for the same path.
+
+        Parameters:
+            path: capture file, see capture_file
+            header: its header, read from the file when None
+            frequencies: dominant frequency per channel in Hz
+            tdoa: channels x channels time differences in seconds
+
+        Returns the run id. '''
+
+        path = os.path.abspath(path)
+        if header is None:
+            header = capture_file.read(path).header
+        settings = header.get("settings", {})
+        shape = header.get("shape", [len(header.get("channels", [])), None])
+        values = dict(header)
+        values.update({ name: settings.get(name) for name in SETTING_COLUMNS })
+        values["num_channels"], values["samples"] = shape
+        if values.get("timestamp") is None and os.path.exists(path):
+            values["timestamp"] = os.path.getmtime(path)
+
+        with self.connection:
+            self.connection.execute("DELETE FROM runs WHERE path = ?", (path,))
+            run_id = self.connection.execute("INSERT INTO runs (path, " + ", ".join(RUN_COLUMNS) + ") VALUES (?" + \
+                    ", ?" * len(RUN_COLUMNS) + ")", [path] + [ values.get(name) for name in RUN_COLUMNS ]).lastrowid
+            overflow = values.get("overflow") or 0
+            self.connection.executemany("INSERT INTO channels VALUES (?, ?, ?, ?)", \
+                    [ (run_id, i, float(frequencies[i]) if frequencies is not None else None, (overflow >> i) & 1) \
+                    for i in range(0, values["num_channels"]) ])
+            if tdoa is not None:
+                self.connection.executemany("INSERT INTO tdoa VALUES (?, ?, ?, ?)", \
+                        [ (run_id, i, j, float(tdoa[i][j])) for i in range(0, len(tdoa)) \
+                        for j in range(0, len(tdoa)) if i != j ])
+        return run_id
+
+    def record(self, scope, path, frequencies = None, tdoa = None):
+        ''' Indexes the scope's last run, written to path with write_capture.
+
+        Computes the dominant frequencies and TDOA when they are not given. '''
+
+        if frequencies is None:
+            frequencies = scope.dominant_frequencies()
+        if tdoa is None:
+            tdoa = scope.tdoa()
+        header = scope.capture_header()
+        header["shape"] = [len(scope.channels), scope.C_MAX_SAMPLES.value]
+        return self.add(path, header, frequencies, tdoa)
+
+    def index(self, directory):
+        ''' Adds the capture files under directory that are not indexed yet.
+
+        Only file metadata is indexed, frequencies and TDOA stay empty.
+        Returns the number of files added. '''
+
+        known = set(row[0] for row in self.connection.execute("SELECT path FROM runs"))
+        added = 0
+        for path in sorted(glob.glob(os.path.join(directory, "**", "*" + capture_file.EXTENSION), recursive = True)):
+            if os.path.abspath(path) not in known:
+                self.add(path)
+                added += 1
+        return added
+
+    def query(self, frequency = None, since = None, until = None, **columns):
+        ''' Finds runs, newest first.
+
+        Parameters:
+            frequency: (low, high) Hz, runs where any channel's dominant
+                frequency is in range
+            since, until: timestamp range in seconds since the epoch
+            columns: any runs column, a value to match or a (low, high)
+                range, e.g. threshold = 0.5, trigger_channel = 0
+
+        Returns sqlite3.Row objects of the runs table. '''
+
+        where = []
+        arguments = []
+        for name, value in columns.items():
+            if name not in RUN_COLUMNS and name != "path":
+                raise ValueError("Unknown column " + name + ", expected one of " + str(RUN_COLUMNS))
+            if isinstance(value, tuple):
+                where.append(name + " BETWEEN ? AND ?")
+                arguments.extend(value)
+            else:
+                where.append(name + " = ?")
+                arguments.append(value)
+        if since is not None:
+            where.append("timestamp >= ?")
+            arguments.append(since)
+        if until is not None:
+            where.append("timestamp < ?")
+            arguments.append(until)
+        if frequency is not None:
+            where.append("id IN (SELECT run_id FROM channels WHERE frequency BETWEEN ? AND ?)")
+            arguments.extend(frequency)
+
+        sql = "SELECT * FROM runs" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY timestamp DESC"
+        return self.connection.execute(sql, arguments).fetchall()
+
+    def channels(self, run_id):
+        ''' Per channel frequency and overflow rows of a run. '''
+        return self.connection.execute("SELECT * FROM channels WHERE run_id = ? ORDER BY channel", (run_id,)).fetchall()
+
+    def tdoa(self, run_id):
+        ''' channels x channels TDOA matrix of a run in seconds, NaN where unknown. '''
+
+        count = self.connection.execute("SELECT num_channels FROM runs WHERE id = ?", (run_id,)).fetchone()[0]
+        matrix = np.full((count, count), np.nan)
+        np.fill_diagonal(matrix, 0)
+        for row in self.connection.execute("SELECT * FROM tdoa WHERE run_id = ?", (run_id,)):
+            matrix[row["channel_one"], row["channel_two"]] = row["seconds"]
+        return matrix
+
+    def load(self, rows = None, **filters):
+        ''' Opens the capture files of rows, or of query(**filters).
+
+        Returns CaptureFile objects, their samples are memory mapped. '''
+
+        if rows is None:
+            rows = self.query(**filters)
+        return [ capture_file.read(row["path"]) for row in rows ]
+
+    def load_array(self, rows = None, **filters):
+        ''' Stacks matching captures into one runs x channels x samples array.
+
+        The captures must all have the same shape and sample type, int16
+        counts or float32 mV, the stack keeps that type. '''
+
+        files = self.load(rows, **filters)
+        if not files:
+            return np.zeros((0, 0, 0), dtype = np.int16)
+        for f in files:
+            if f.raw.shape != files[0].raw.shape or f.raw.dtype != files[0].raw.dtype:
+                raise ValueError("Cannot stack " + f.path + " (" + str(f.raw.shape) + " " + str(f.raw.dtype) + \
+                        ") with " + files[0].path + " (" + str(files[0].raw.shape) + " " + str(files[0].raw.dtype) + ")")
+        stack = np.empty((len(files),) + files[0].raw.shape, dtype = files[0].raw.dtype)
+        for i in range(0, len(files)):
+            stack[i] = files[i].raw
+        return stack
+
+    def close(self):
+        self.connection.close()
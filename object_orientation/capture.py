@@ -0,0 +1,115 @@
+import numpy as np
+
+class Capture:
+    ''' One block of samples taken by Acoustics.
+
+    raw holds the int16 ADC counts as channels x samples and adc_2mV the
+    same samples in millivolts. trigger_index is the sample the scope
+    triggered on.
+
+    A Capture cannot be changed through, its arrays are read only views.
+    The derived views, adc_2mV, the time axis and the spectra, are
+    computed the first time they are used and then shared by every
+    consumer.
+
+    Captures from Acoustics, Pipeline and SharedRing.read borrow buffers
+    that are overwritten by later runs, use copy() to keep one. The
+    capture files give Captures that own their samples. '''
+
+    __slots__ = ("run_name", "raw", "mV_per_count", "time_interval_ns", "trigger_index", "overflow", \
+            "_adc_2mV", "_mV_out", "_time", "_spectrum", "_magnitude", "_frequencies")
+
+    def __init__(self, run_name, raw, adc_2mV = None, time_interval_ns = 0, trigger_index = 0, overflow = 0, \
+            mV_per_count = None, mV_out = None):
+        '''
+        Parameters:
+            raw: channels x samples ADC counts
+            adc_2mV: raw in mV, or None to convert raw with mV_per_count
+                when first used
+            time_interval_ns: sample interval
+            trigger_index: trigger sample
+            overflow: the driver's over range channel bit mask
+            mV_per_count: raw to mV scale, needed when adc_2mV is None
+            mV_out: float32 array shaped like raw that the conversion is
+                written into, a new one when None
+        '''
+        if adc_2mV is None and mV_per_count is None:
+            raise ValueError("A Capture needs adc_2mV or mV_per_count")
+        assign = object.__setattr__
+        assign(self, "run_name", run_name)
+        assign(self, "raw", read_only(raw))
+        assign(self, "mV_per_count", mV_per_count)
+        assign(self, "time_interval_ns", time_interval_ns)
+        assign(self, "trigger_index", trigger_index)
+        assign(self, "overflow", overflow)
+        assign(self, "_adc_2mV", read_only(adc_2mV) if adc_2mV is not None else None)
+        assign(self, "_mV_out", mV_out)
+        assign(self, "_time", None)
+        assign(self, "_spectrum", None)
+        assign(self, "_magnitude", None)
+        assign(self, "_frequencies", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Capture is immutable")
+
+    def _memo(self, name, value):
+        view = read_only(value)
+        object.__setattr__(self, name, view)
+        return view
+
+    @property
+    def adc_2mV(self):
+        ''' The samples in mV, channels x samples float32. '''
+        if self._adc_2mV is None:
+            return self._memo("_adc_2mV", np.multiply(self.raw, np.float32(self.mV_per_count), out = self._mV_out, \
+                    dtype = np.float32))
+        return self._adc_2mV
+
+    @property
+    def time(self):
+        ''' Sample times in ns. '''
+        if self._time is None:
+            return self._memo("_time", np.arange(0, self.raw.shape[-1]) * self.time_interval_ns)
+        return self._time
+
+    def get_time(self):
+        ''' Returns the sample times in ns. '''
+        return self.time
+
+    @property
+    def spectrum(self):
+        ''' rfft of every channel of adc_2mV. '''
+        if self._spectrum is None:
+            from scipy import fft
+            return self._memo("_spectrum", fft.rfft(self.adc_2mV, axis = -1))
+        return self._spectrum
+
+    @property
+    def magnitude(self):
+        ''' abs(spectrum). '''
+        if self._magnitude is None:
+            return self._memo("_magnitude", np.abs(self.spectrum))
+        return self._magnitude
+
+    @property
+    def frequencies(self):
+        ''' Frequency axis of spectrum in Hz. '''
+        if self._frequencies is None:
+            return self._memo("_frequencies", np.fft.rfftfreq(self.raw.shape[-1], self.time_interval_ns * 1e-9))
+        return self._frequencies
+
+    def dominant_frequencies(self):
+        ''' Frequency of the largest spectral peak of each channel. '''
+        return self.frequencies[np.argmax(self.magnitude, axis = -1)]
+
+    def copy(self):
+        ''' A Capture holding its own copy of the samples. '''
+        return Capture(self.run_name, np.array(self.raw), None if self._adc_2mV is None else np.array(self._adc_2mV), \
+                self.time_interval_ns, self.trigger_index, self.overflow, self.mV_per_count)
+
+def read_only(array):
+    ''' A view of array that cannot be written through. '''
+
+    view = np.asarray(array).view()
+    view.flags.writeable = False
+    return view
@@ -0,0 +1,107 @@
+''' Binary capture files.
+
+Layout:
+    8 bytes  magic b"ACAPTURE"
+    2 bytes  format version, little endian uint16
+    4 bytes  header length in bytes, little endian uint32
+    header   UTF-8 JSON, padded with spaces so the samples start on a
+             64 byte boundary
+    samples  channels x samples int16 ADC counts, C order, little endian.
+             Files converted from mV data may hold float32 instead, the
+             header "dtype" says which.
+
+The header holds everything needed to use the samples: run_name, model,
+channel map, sample interval, trigger index and settings, range and the
+mV per count scale. Readers memory-map the samples, so opening a file
+costs the same whatever its size. '''
+
+import json
+import struct
+import numpy as np
+from capture import Capture
+
+MAGIC = b"ACAPTURE"
+VERSION = 1
+PREFIX = struct.Struct("<8sHI")
+ALIGN = 64
+EXTENSION = ".acap"
+
+# Sample types a file may hold, float32 files store mV with mV_per_count = 1
+DTYPES = ("<i2", "<f4")
+
+def write_header(f, header, shape, dtype = "<i2"):
+    ''' Writes the prefix and header, f is left at the start of the samples. '''
+
+    header = dict(header)
+    header["shape"] = list(shape)
+    header["dtype"] = np.dtype(dtype).newbyteorder("<").str
+    if header["dtype"] not in DTYPES:
+        raise ValueError("Capture files hold " + str(DTYPES) + " samples, not " + header["dtype"])
+    text = json.dumps(header).encode()
+    text += b" " * (-(PREFIX.size + len(text)) % ALIGN)
+    f.write(PREFIX.pack(MAGIC, VERSION, len(text)))
+    f.write(text)
+    return PREFIX.size + len(text)
+
+def write(path, raw, header):
+    ''' Writes a channels x samples int16 array and its header dict to path. '''
+
+    with open(path, "wb") as f:
+        write_header(f, header, raw.shape)
+        np.asarray(raw, dtype = "<i2").tofile(f)
+
+def create(path, header, shape, dtype = "<i2"):
+    ''' Creates a capture file and returns its samples as a writable np.memmap.
+
+    For captures too large to hold in memory, fill the memmap in pieces
+    and flush() it when done. '''
+
+    with open(path, "wb") as f:
+        offset = write_header(f, header, shape, dtype)
+    return np.memmap(path, dtype = np.dtype(dtype).newbyteorder("<"), mode = "r+", offset = offset, shape = tuple(shape))
+
+class CaptureFile:
+    ''' Capture file opened for reading.
+
+    raw is a read only np.memmap of the int16 counts (float32 mV for
+    converted files), nothing is read from disk until it is used. '''
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, length = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(str(path) + " is not a capture file")
+            if version > VERSION:
+                raise ValueError(str(path) + " has capture format version " + str(version) + \
+                        ", newest supported is " + str(VERSION))
+            self.header = json.loads(f.read(length))
+        self.raw = np.memmap(path, dtype = self.header["dtype"], mode = "r", \
+                offset = PREFIX.size + length, shape = tuple(self.header["shape"]))
+
+    def __getattr__(self, name):
+        ''' Header fields read as attributes, capture.run_name etc. '''
+        try:
+            return self.__dict__["header"][name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def mV(self, start = 0, end = None, channels = None):
+        ''' Converts samples [start, end) of channels (default all) to float32 mV. '''
+
+        raw = self.raw if channels is None else self.raw[channels]
+        return np.multiply(raw[..., start:end], np.float32(self.header["mV_per_count"]), dtype = np.float32)
+
+    def get_time(self):
+        ''' Returns the sample times in ns. '''
+        return np.arange(0, self.raw.shape[-1]) * self.header["time_interval_ns"]
+
+    def to_capture(self):
+        ''' Returns the file as a Capture, converted to mV when first used. '''
+
+        return Capture(self.header["run_name"], self.raw, None, self.header["time_interval_ns"], \
+                self.header["trigger_index"], self.header["overflow"], self.header["mV_per_count"])
+
+def read(path):
+    ''' Opens a capture file, see CaptureFile. '''
+    return CaptureFile(path)
@@ -0,0 +1,121 @@
+import numpy as np
+import capture_file
+import fir
+import sig_proc
+
+class PingResult:
+    ''' One ping found in a recording.
+
+    start and end are sample positions (end exclusive), frequencies the
+    dominant frequency of each channel in Hz and tdoa the all-pairs time
+    differences in seconds, entry (i, j) is channel i relative to j. '''
+
+    def __init__(self, start, end, time_interval_ns, frequencies, tdoa):
+        self.start = start
+        self.end = end
+        self.start_time = start * time_interval_ns * 1e-9
+        self.end_time = end * time_interval_ns * 1e-9
+        self.frequencies = frequencies
+        self.tdoa = tdoa
+
+class ChunkedAnalysis:
+    ''' Finds and analyzes the pings of a recording in fixed size chunks.
+
+    The recording is read in order, chunk_samples at a time, usually from
+    a memory mapped capture file, so memory use does not depend on its
+    length. The ping detector and prefilter keep their state from one
+    chunk to the next. The previous chunk is kept so a ping window
+    padded by max_lag can reach back across the chunk boundary. '''
+
+    def __init__(self, raw, time_interval_ns, mV_per_count = 1.0, chunk_samples = 1 << 20, \
+            ping_detect = 0.025, noise_length = 100, weighting = "plain", max_lag = None, prefilter = None, \
+            band = sig_proc.PINGER_BAND, filter_band = None):
+        '''
+        Parameters:
+            raw: channels x samples array, counts or mV, e.g. CaptureFile.raw
+            time_interval_ns: sample interval
+            mV_per_count: scale from raw to mV
+            chunk_samples: samples per chunk and channel
+            ping_detect: volts, as Acoustics.ping_detect
+            noise_length: quiet samples that end a ping
+            weighting: GCC weighting for the TDOA
+            max_lag: largest TDOA searched in samples, pads the ping windows
+            prefilter: called with every mV chunk in order, returns it
+                filtered, may keep state between calls
+            band: (low, high) Hz searched for the dominant frequency, None
+                for the whole spectrum
+            filter_band: (low, high) Hz fir.OverlapSave bandpass applied
+                after prefilter, its delay is taken out of the ping
+                positions and its tail is flushed at the end
+        '''
+        self.raw = raw
+        self.time_interval_ns = time_interval_ns
+        self.scale = np.float32(mV_per_count)
+        self.chunk_samples = chunk_samples
+        self.weighting = weighting
+        self.max_lag = max_lag
+        self.prefilter = prefilter
+        self.bandpass = None
+        self.delay = 0 # samples the bandpass output lags the recording
+        if filter_band is not None:
+            self.bandpass = fir.OverlapSave(fir.design(time_interval_ns * 1e-9, tuple(filter_band)), raw.shape[0])
+            self.delay = self.bandpass.delay
+        self.band = band
+        self.tracker = sig_proc.PingTracker(ping_detect * 1000, noise_length)
+        self.pad = max_lag or 0
+
+    @classmethod
+    def from_file(cls, capture, **options):
+        ''' Analysis of a capture_file.CaptureFile. '''
+        return cls(capture.raw, capture.time_interval_ns, capture.mV_per_count, **options)
+
+    def pings(self):
+        ''' Yields a PingResult for every ping, in order. '''
+
+        length = self.raw.shape[-1] + self.delay # processed samples, the bandpass output runs delay longer
+        history = np.zeros((self.raw.shape[0], 0), dtype = np.float32) # processed samples kept
+        history_start = 0
+        pending = [] # pings waiting for the samples after them
+        for start in range(0, self.raw.shape[-1], self.chunk_samples):
+            chunk = np.multiply(self.raw[:, start:start + self.chunk_samples], self.scale, dtype = np.float32)
+            if self.prefilter is not None:
+                chunk = self.prefilter(chunk)
+            if self.bandpass is not None:
+                chunk = self.bandpass.process(chunk)
+                if start + self.chunk_samples >= self.raw.shape[-1]:
+                    # Flush the last delay samples out of the filter with silence
+                    tail = self.bandpass.process(np.zeros((len(chunk), self.delay), dtype = np.float32))
+                    chunk = np.concatenate((chunk, tail), axis = -1)
+            # Keep only the previous chunk, enough for windows across the boundary
+            keep = history[:, max(history.shape[-1] - self.chunk_samples, 0):]
+            history_start += history.shape[-1] - keep.shape[-1]
+            history = np.concatenate((keep, chunk), axis = -1)
+
+            pending += self.tracker.update(np.abs(chunk).max(axis = 0))
+            available = start + chunk.shape[-1]
+            if available == length:
+                pending += self.tracker.flush()
+            while pending and (pending[0][1] + self.pad <= available or available == length):
+                yield self.analyze(*pending.pop(0), history, history_start)
+
+    def analyze(self, start, end, history, history_start):
+        first = max(start - self.pad, 0)
+        last = min(end + self.pad, self.raw.shape[-1] + self.delay)
+        if first >= history_start:
+            window = history[:, first - history_start:last - history_start]
+        else:
+            # Longer than a chunk, read it again, unfiltered
+            window = np.multiply(self.raw[:, max(first - self.delay, 0):last - self.delay], self.scale, dtype = np.float32)
+
+        tstep = self.time_interval_ns * 1e-9
+        if self.band is not None:
+            frequencies = sig_proc.band_frequency(window, tstep, self.band)
+        else:
+            frequencies = sig_proc.dominant_frequency(window, tstep)
+        tdoa = (sig_proc.gcc_matrix(window, self.weighting, self.max_lag) - (window.shape[-1] - 1)) * tstep
+        return PingResult(max(start - self.delay, 0), end - self.delay, self.time_interval_ns, frequencies, tdoa)
+
+def analyze_file(path, **options):
+    ''' Yields the PingResults of a capture file, see ChunkedAnalysis. '''
+
+    return ChunkedAnalysis.from_file(capture_file.read(path), **options).pings()
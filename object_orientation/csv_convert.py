@@ -0,0 +1,223 @@
+#!/bin/python3
+
+''' Converts legacy CSV captures into capture files, see capture_file.
+
+Two layouts are recognized from the first lines of a file:
+    rows:    Acoustics.write_csv, a title line then one line per sample,
+             "time, channel 0, channel 1, ..."
+    columns: Run_To_CSV.py and Pool_Test_code, a title line, a line of
+             times, then one line of samples per channel
+
+Files are read in fixed size chunks and written straight into the
+memory mapped capture file, so memory use does not grow with the
+length of a line or of the file. Several files convert in parallel. '''
+
+import argparse
+import concurrent.futures
+import os
+import sys
+import numpy as np
+import capture_file
+
+CHUNK = 16 << 20 # bytes read at a time
+INT16_MAX = 32767
+
+def parse(text):
+    ''' Comma separated numbers to a float64 array. '''
+
+    text = text.replace(b"\r", b"").replace(b"\n", b",").strip(b", ")
+    if not text:
+        return np.zeros(0)
+    return np.fromstring(text, sep = ",")
+
+def first_lines(path, limit = CHUNK):
+    ''' The title line and up to limit bytes of the second line. '''
+
+    with open(path, "rb") as f:
+        titles = f.readline(limit)
+        second = f.readline(limit)
+    return titles, second
+
+def detect_layout(path):
+    ''' Returns "rows" or "columns". '''
+
+    titles, second = first_lines(path)
+    fields = titles.count(b",") + 1
+    if second.endswith(b"\n") and second.count(b",") + 1 == fields:
+        return "rows"
+    return "columns"
+
+def count_lines(path, chunk = CHUNK):
+    ''' Number of lines and number of commas on the second line. '''
+
+    lines = 0
+    commas = 0
+    last = b"\n"
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk)
+            if not block:
+                break
+            line = lines
+            offset = 0
+            while line < 2:
+                end = block.find(b"\n", offset)
+                if line == 1:
+                    commas += block[offset:end if end >= 0 else len(block)].count(b",")
+                if end < 0:
+                    break
+                offset = end + 1
+                line += 1
+            lines += block.count(b"\n")
+            last = block[-1:]
+    if last != b"\n": # no newline after the last line
+        lines += 1
+    return lines, commas
+
+def line_pieces(f, chunk = CHUNK):
+    ''' Yields (line number, values) pieces of every line after the titles.
+
+    A long line comes out as several pieces in order, each one at most
+    about chunk bytes of text. '''
+
+    f.readline()
+    line = 0
+    carry = b""
+    while True:
+        block = f.read(chunk)
+        if not block:
+            values = parse(carry)
+            if len(values):
+                yield line, values
+            return
+        lines = (carry + block).split(b"\n")
+        for text in lines[:-1]:
+            yield line, parse(text)
+            line += 1
+        cut = lines[-1].rfind(b",")
+        if cut >= 0:
+            yield line, parse(lines[-1][:cut])
+        carry = lines[-1][cut + 1:]
+
+def row_blocks(f, fields, chunk = CHUNK):
+    ''' Yields samples x fields blocks of a row layout file after the titles. '''
+
+    f.readline()
+    carry = b""
+    while True:
+        block = f.read(chunk)
+        if not block:
+            if carry.strip():
+                yield parse(carry).reshape(-1, fields)
+            return
+        block = carry + block
+        cut = block.rfind(b"\n") + 1
+        carry = block[cut:]
+        values = parse(block[:cut])
+        if len(values):
+            yield values.reshape(-1, fields)
+
+def store(out, channel, start, mV, scale):
+    ''' Writes mV samples into out, quantized to counts for int16 files. '''
+
+    if out.dtype == np.int16:
+        out[channel, start:start + len(mV)] = np.clip(np.rint(mV / scale), -INT16_MAX - 1, INT16_MAX)
+    else:
+        out[channel, start:start + len(mV)] = mV
+
+def convert(path, destination = None, dtype = "int16", range_mV = 2000, chunk = CHUNK):
+    ''' Converts one CSV capture, returns the capture file path.
+
+    Parameters:
+        path: the CSV
+        destination: output directory, next to the CSV by default
+        dtype: "int16" stores ADC counts for a range_mV channel range, as
+            the scope produced them, "float32" stores the mV values as is
+        range_mV: channel range the capture was taken with
+        chunk: bytes read at a time, bounds memory use '''
+
+    layout = detect_layout(path)
+    lines, commas = count_lines(path, chunk)
+    titles = first_lines(path)[0].decode(errors = "replace").strip().split(",")
+    if layout == "rows":
+        shape = (len(titles) - 1, lines - 1)
+    else:
+        shape = (lines - 2, commas + 1)
+    scale = range_mV / INT16_MAX if dtype == "int16" else 1.0
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    output = os.path.join(destination if destination is not None else os.path.dirname(path), \
+            name + capture_file.EXTENSION)
+    header = {
+        "run_name": name,
+        "model": "csv",
+        "channels": list(range(0, shape[0])),
+        "channel_titles": titles[1:] if layout == "rows" else titles[1:shape[0] + 1],
+        "time_interval_ns": None,
+        "trigger_index": None,
+        "range_mV": range_mV,
+        "mV_per_count": scale,
+        "overflow": 0,
+        "source": os.path.abspath(path),
+        "layout": layout,
+    }
+    # The time axis is only needed for its step, read the first two times up front
+    with open(path, "rb") as f:
+        if layout == "rows":
+            first = next(row_blocks(f, len(titles), 1 << 16), np.zeros((0, 1)))[:2, 0]
+        else:
+            first = next(line_pieces(f, 1 << 16), (0, np.zeros(0)))[1][:2]
+    if len(first) == 2:
+        header["time_interval_ns"] = float(first[1] - first[0])
+
+    out = capture_file.create(output, header, shape, "<i2" if dtype == "int16" else "<f4")
+    with open(path, "rb") as f:
+        if layout == "rows":
+            start = 0
+            for block in row_blocks(f, len(titles), chunk):
+                for channel in range(0, shape[0]):
+                    store(out, channel, start, block[:, channel + 1], scale)
+                start += len(block)
+        else:
+            filled = [0] * (shape[0] + 1)
+            for line, values in line_pieces(f, chunk):
+                if 1 <= line <= shape[0]: # line 0 holds the times
+                    store(out, line - 1, filled[line], values, scale)
+                    filled[line] += len(values)
+    out.flush()
+    del out
+    return output
+
+def convert_all(paths, destination = None, dtype = "int16", range_mV = 2000, jobs = None, chunk = CHUNK):
+    ''' Converts many CSVs on a process pool, returns {csv path: capture file path or the error}. '''
+
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        futures = { pool.submit(convert, path, destination, dtype, range_mV, chunk): path for path in paths }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                results[futures[future]] = e
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description = "Converts legacy CSV captures to capture files.")
+    parser.add_argument("paths", nargs = "+")
+    parser.add_argument("--out", default = None, help = "output directory, next to each CSV by default")
+    parser.add_argument("--dtype", choices = ("int16", "float32"), default = "int16")
+    parser.add_argument("--range-mV", type = float, default = 2000, help = "channel range for int16 output")
+    parser.add_argument("--jobs", type = int, default = None)
+    parser.add_argument("--chunk-mb", type = int, default = CHUNK >> 20)
+    args = parser.parse_args()
+
+    failed = False
+    results = convert_all(args.paths, args.out, args.dtype, args.range_mV, args.jobs, args.chunk_mb << 20)
+    for path in args.paths:
+        result = results[path]
+        failed = failed or isinstance(result, Exception)
+        print(path + " -> " + str(result))
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
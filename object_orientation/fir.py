@@ -0,0 +1,103 @@
+import functools
+import numpy as np
+import sig_proc
+
+@functools.lru_cache(maxsize = 16)
+def design(tstep, band = sig_proc.PINGER_BAND, transition = 5000, attenuation = 60):
+    ''' Linear phase bandpass FIR taps, cached per sample interval and band.
+
+        Parameters:
+            tstep: sample interval in seconds
+            band: (low, high) Hz passed
+            transition: Hz from the band edge to full attenuation
+            attenuation: stop band attenuation in dB
+
+        Returns a read only float32 array with an odd number of taps, the
+        delay is (taps - 1) / 2 samples. '''
+
+    from scipy import signal
+    rate = 1 / tstep
+    count, beta = signal.kaiserord(attenuation, transition / (rate / 2))
+    count |= 1 # odd, a whole sample delay
+    # firwin cutoffs are the -6 dB points, put them half a transition outside the band
+    low = max(band[0] - transition / 2, 1)
+    high = min(band[1] + transition / 2, rate / 2 * 0.999)
+    taps = signal.firwin(count, (low, high), window = ("kaiser", beta), pass_zero = False, fs = rate).astype(np.float32)
+    taps.flags.writeable = False
+    return taps
+
+class OverlapSave:
+    ''' Stateful FIR filter for multichannel blocks, by FFT overlap-save.
+
+    Blocks are filtered in order, any length, and the last taps - 1 input
+    samples carry over, so a signal filtered in pieces comes out the same
+    as filtered whole. All channels go through one FFT call per segment
+    into preallocated buffers. Pieces of at least step samples use the FFT
+    fully, smaller ones still cost a whole segment.
+
+    The output lags the input by delay samples. '''
+
+    def __init__(self, taps, channels, size = None):
+        '''
+        Parameters:
+            taps: FIR coefficients, e.g. from design()
+            channels: number of channels filtered together
+            size: FFT length, by default a fast length of about 8x the taps
+        '''
+        from scipy import fft
+        self.taps = np.asarray(taps, dtype = np.float32)
+        self.overlap = len(self.taps) - 1
+        self.size = fft.next_fast_len(max(size or 8 * len(self.taps), len(self.taps) + 1), real = True)
+        self.step = self.size - self.overlap # new samples per segment
+        self.delay = self.overlap // 2
+        self.response = fft.rfft(self.taps, self.size).astype(np.complex64)
+        self.work = np.zeros((channels, self.size), dtype = np.float32) # history, then new samples
+
+    def reset(self):
+        ''' Forgets the carried over samples, as if starting on silence. '''
+        self.work[:] = 0
+
+    def process(self, block, out = None):
+        ''' Filters the next channels x samples block.
+
+            Returns the filtered float32 block, written into out if given. '''
+
+        from scipy import fft
+        block = np.atleast_2d(block)
+        count = block.shape[-1]
+        if out is None:
+            out = np.empty((len(self.work), count), dtype = np.float32)
+        done = 0
+        while done < count:
+            take = min(self.step, count - done)
+            self.work[:, self.overlap:self.overlap + take] = block[:, done:done + take]
+            spectrum = fft.rfft(self.work, axis = -1)
+            spectrum *= self.response
+            # Outputs before overlap wrapped around the circular convolution, the rest are exact
+            out[:, done:done + take] = fft.irfft(spectrum, self.size, axis = -1, overwrite_x = True)[:, self.overlap:self.overlap + take]
+            self.work[:, :self.overlap] = self.work[:, take:take + self.overlap]
+            done += take
+        return out
+
+def bandpass(channels, tstep, band = sig_proc.PINGER_BAND, out = None):
+    ''' Bandpass filters a whole block capture without delay.
+
+        Parameters:
+            channels: one channel or channels x samples
+            tstep: sample interval in seconds
+            band: (low, high) Hz passed
+            out: channels x samples float32 array for the result
+
+        The filter starts and ends on silence, the delay of design() is
+        removed so pings keep their sample positions. '''
+
+    channels = np.atleast_2d(channels)
+    count = channels.shape[-1]
+    engine = OverlapSave(design(float(tstep), tuple(band)), len(channels))
+    padded = np.empty((len(channels), count + engine.delay), dtype = np.float32)
+    engine.process(channels, padded[:, :count])
+    engine.process(np.zeros((len(channels), engine.delay), dtype = np.float32), padded[:, count:])
+    if out is None:
+        return padded[:, engine.delay:]
+    out[:] = padded[:, engine.delay:]
+    return out
@@ -0,0 +1,161 @@
+import functools
+import math
+import os
+import sys
+import numpy as np
+import sig_proc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Simulation'))
+from Simulation import Ping
+
+class Detection:
+    ''' One ping found by MatchedFilter.
+
+    start and end are the estimated first and one past the last sample
+    of the ping, start is negative when the ping began before the
+    capture. start_time and end_time are the same in seconds, frequency
+    is the best matching template's in Hz and snr the correlation peak
+    over the noise floor in dB. '''
+
+    def __init__(self, channel, start, end, time_interval_ns, frequency, snr):
+        self.channel = channel
+        self.start = start
+        self.end = end
+        self.start_time = start * time_interval_ns * 1e-9
+        self.end_time = end * time_interval_ns * 1e-9
+        self.frequency = frequency
+        self.snr = snr
+
+    def __repr__(self):
+        return "Detection(channel = %d, start = %d, end = %d, frequency = %.0f, snr = %.1f dB)" % \
+                (self.channel, self.start, self.end, self.frequency, self.snr)
+
+@functools.lru_cache(maxsize = 256)
+def template_spectrum(frequency, tstep, duration, length):
+    ''' Band of the conjugate spectrum of one unit energy tone burst template.
+
+        The template is Simulation.Ping.generate_ping. Only the bins within
+        4 / duration Hz of frequency are kept, the rest of a tone burst's
+        energy is negligible.
+
+        Returns (first bin, conjugate spectrum of the band, template samples). '''
+
+    from scipy import fft
+    ping = Ping(duration, frequency, 1, tstep)
+    ping.generate_ping()
+    template = ping.ping_values / np.sqrt(np.sum(ping.ping_values ** 2))
+
+    half_width = int(math.ceil(4 / duration * length * tstep)) # bins
+    centre = int(round(frequency * length * tstep))
+    first = min(max(centre - half_width, 0), length // 2 + 1 - 2 * half_width)
+    spectrum = fft.rfft(template, length)[first:first + 2 * half_width]
+    return first, np.conj(spectrum).astype(np.complex64), len(template)
+
+@functools.lru_cache(maxsize = 16)
+def template_bank(frequencies, tstep, duration, length):
+    ''' Stacked template_spectrum bands of every frequency for one FFT length.
+
+        Returns (bin index of every band entry, conjugate spectra, envelope
+        length, template samples). '''
+
+    from scipy import fft
+    bands = [ template_spectrum(frequency, tstep, duration, length) for frequency in frequencies ]
+    width = len(bands[0][1])
+    bins = np.array([ np.arange(first, first + width) for first, spectrum, samples in bands ])
+    spectra = np.array([ spectrum for first, spectrum, samples in bands ])
+    return bins, spectra, fft.next_fast_len(4 * width), bands[0][2]
+
+class MatchedFilter:
+    ''' Finds pings by correlating captures with tone burst templates.
+
+    Each channel is transformed once and multiplied by the cached spectra
+    of every candidate frequency's template. Only the band around each
+    template frequency is transformed back, giving the correlation
+    envelope at a reduced rate, so a capture costs one forward FFT per
+    channel and a few short inverse FFTs.
+
+    The noise floor is the median envelope of a channel over every
+    template, a ping only raises the few templates near its frequency. '''
+
+    def __init__(self, frequencies = None, duration = 2e-3, threshold = 14, gap = None):
+        '''
+        Parameters:
+            frequencies: template frequencies in Hz, by default every 250 Hz
+                across sig_proc.PINGER_BAND
+            duration: template length in seconds, at most the ping length
+            threshold: detection SNR in dB
+            gap: seconds below threshold that end a detection, by default
+                the template duration
+        '''
+        if frequencies is None:
+            frequencies = np.arange(sig_proc.PINGER_BAND[0], sig_proc.PINGER_BAND[1] + 1, 250)
+        self.frequencies = tuple(float(f) for f in frequencies)
+        self.duration = duration
+        self.threshold = threshold
+        self.gap = gap if gap is not None else duration
+
+    def envelopes(self, channels, tstep):
+        ''' Correlation envelope of every channel with every template.
+
+            Returns (channels x templates x envelope samples, samples per
+            envelope sample, template samples, FFT length). '''
+
+        from scipy import fft
+        channels = np.atleast_2d(channels)
+        length = channels.shape[-1]
+        n = fft.next_fast_len(length + int(self.duration / tstep), real = True)
+        bins, spectra, size, samples = template_bank(self.frequencies, float(tstep), self.duration, n)
+
+        spectrum = fft.rfft(channels, n, axis = -1)
+        # Analytic signal of the correlation, shifted down by each band's first bin
+        product = spectrum[:, bins] * spectra
+        envelope = np.abs(fft.ifft(product, size, axis = -1)) * (2 * size / n)
+        return envelope, n / size, samples, n
+
+    def detect(self, channels, tstep):
+        ''' Finds the pings on every channel.
+
+            Parameters:
+                channels: one channel or channels x samples, mV or counts
+                tstep: sample interval in seconds
+
+            Returns a list of Detection, ordered by channel then start. '''
+
+        channels = np.atleast_2d(channels)
+        length = channels.shape[-1]
+        envelope, step, samples, n = self.envelopes(channels, tstep)
+        # Negative lags wrap to the end, move them in front and drop the lags past the capture
+        before = int((samples - 1) // step)
+        envelope = np.roll(envelope, before, axis = -1)[..., :before + int(math.ceil(length / step))]
+        lags = (np.arange(0, envelope.shape[-1]) - before) * step
+
+        noise = np.median(envelope.reshape(len(envelope), -1), axis = -1) / math.sqrt(math.log(2)) # rms of a Rayleigh floor
+        ratio = envelope / np.maximum(noise, np.finfo(np.float32).tiny)[:, None, None]
+        best = ratio.max(axis = 1)
+        template = ratio.argmax(axis = 1)
+        runs = sig_proc.detect_pings(best, 10 ** (self.threshold / 20), max(int(math.ceil(self.gap / tstep / step)), 1))
+
+        detections = []
+        for channel in range(0, len(runs)):
+            for first, last in runs[channel]:
+                peak = first + int(np.argmax(best[channel, first:last]))
+                # The envelope of a ping is a trapezoid, half its peak is half a template from either end
+                half = best[channel, peak] / 2
+                rise = crossing(best[channel], half, peak, -1)
+                fall = crossing(best[channel], half, peak, 1)
+                start = np.interp(rise, np.arange(0, len(lags)), lags) + samples / 2
+                end = np.interp(fall, np.arange(0, len(lags)), lags) + samples / 2
+                detections.append(Detection(channel, int(round(start)), int(round(end)), tstep * 1e9, \
+                        self.frequencies[template[channel, peak]], float(20 * np.log10(best[channel, peak]))))
+        return sorted(detections, key = lambda d: (d.channel, d.start))
+
+def crossing(values, level, peak, direction):
+    ''' Fractional index where values falls below level, going from peak in direction. '''
+
+    index = peak
+    while 0 <= index + direction < len(values) and values[index + direction] >= level:
+        index += direction
+    after = index + direction
+    if not 0 <= after < len(values):
+        return float(index)
+    return index + direction * (values[index] - level) / (values[index] - values[after])
@@ -1,5 +1,6 @@
 from acoustics import *
 from picosdk.ps2000a import ps2000a as ps
+from picosdk.functions import assert_pico_ok
 
 class Pico_2000a(Acoustics):
     def __init__(self, num_channels = 4, delta_x = 0, delta_z = 0):
@@ -11,8 +12,9 @@ class Pico_2000a(Acoustics):
         self.MAX_SAMPLES = self.PRE_TRIGGER_SAMPLES + self.POST_TRIGGER_SAMPLES
         self.TIME_INDISPOSED = None # milliseconds
         self.SEGMENT_INDEX = 0
-        self.LP_READY = None # uses ps2000aIsReady, not ps2000aBlockReady
+        self.LP_READY = ps.BlockReadyType(self.block_ready_callback) # ps2000aBlockReady, see arm()
         self.P_PARAMETER = None
+        self.STREAMING_READY = ps.StreamingReadyType(self.streaming_callback)
 
     def init_channels(self):
         self.COUPLING_TYPE = 1 # PS2000a_DC
@@ -76,8 +78,10 @@ class Pico_2000a(Acoustics):
         Parameters:
             trigger_channel: The channel number to watch
             threshold: The minimum signal voltage to trigger
-            delay: milliseconds to delay after trigger
-            auto_trigger: milliseconds to trigger without passing threshold
+            delay: samples from the trigger to the start of the post
+                trigger samples, the driver counts it in sample periods
+            auto_trigger: milliseconds to trigger without passing threshold,
+                0 waits for the threshold
         '''
         self.status["trigger"] = ps.ps2000aSetSimpleTrigger(self.chandle, self.ENABLED, \
                 trigger_channel, super().volts_to_adc(threshold), self.DIRECTION, delay, auto_trigger)
@@ -86,24 +90,74 @@ class Pico_2000a(Acoustics):
         '''Creates buffers to capture data.'''
         for i in range(0, len(self.channels)):
             self.status["setDataBuffers" + str(i)] = ps.ps2000aSetDataBuffers(self.chandle, i, \
-                    ctypes.byref(self.buffer_maxes[i]), ctypes.byref(self.buffer_mins[i]), self.MAX_SAMPLES, self.SEGMENT_INDEX, self.MODE)
+                    self.buffer_maxes[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), \
+                    self.buffer_mins[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)) \
+                    if self.buffer_mins is not None else None, self.MAX_SAMPLES, self.SEGMENT_INDEX, self.MODE)
             assert_pico_ok(self.status["setDataBuffers" + str(i)])
 
-    def block(self):
+    def arm(self):
+        self.start_arm()
         self.status["runBlock"] = ps.ps2000aRunBlock(self.chandle, self.PRE_TRIGGER_SAMPLES, \
                 self.POST_TRIGGER_SAMPLES, self.TIMEBASE, self.OVERSAMPLE, self.TIME_INDISPOSED, \
                 self.SEGMENT_INDEX, self.LP_READY, self.P_PARAMETER)
         assert_pico_ok(self.status["runBlock"])
-
-        self.ready.value = 0
-        while self.ready.value == self.check.value:
-            self.status["isReady"] = ps.ps2000aIsReady(self.chandle, ctypes.byref(self.ready))
+        return self.block_ready
 
     def values_call(self):
+        self.C_MAX_SAMPLES.value = self.MAX_SAMPLES # the driver returns the downsampled count here
         self.status["getValues"] = ps.ps2000aGetValues(self.chandle, self.START_INDEX, \
                 ctypes.byref(self.C_MAX_SAMPLES), self.DOWNSAMPLE_RATIO, self.DOWNSAMPLE_RATIO_MODE, \
                 0, ctypes.byref(self.overflow))
 
+    def segments(self, count):
+        self.status["memorySegments"] = ps.ps2000aMemorySegments(self.chandle, count, \
+                ctypes.byref(self.returned_max_samples))
+        assert_pico_ok(self.status["memorySegments"])
+        self.status["setNoOfCaptures"] = ps.ps2000aSetNoOfCaptures(self.chandle, count)
+        assert_pico_ok(self.status["setNoOfCaptures"])
+
+    def segment_buffers(self):
+        for segment in range(0, len(self.rapid_maxes)):
+            for i in range(0, len(self.channels)):
+                self.status["setDataBuffers" + str(i)] = ps.ps2000aSetDataBuffers(self.chandle, i, \
+                        self.rapid_maxes[segment][i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), None, \
+                        self.MAX_SAMPLES, segment, self.MODE)
+                assert_pico_ok(self.status["setDataBuffers" + str(i)])
+
+    def values_bulk_call(self):
+        self.C_MAX_SAMPLES.value = self.MAX_SAMPLES
+        self.status["getValuesBulk"] = ps.ps2000aGetValuesBulk(self.chandle, ctypes.byref(self.C_MAX_SAMPLES), \
+                0, len(self.rapid_maxes) - 1, self.DOWNSAMPLE_RATIO, self.DOWNSAMPLE_RATIO_MODE, \
+                ctypes.byref(self.rapid_overflow))
+        assert_pico_ok(self.status["getValuesBulk"])
+
+    def trigger_time_offset(self):
+        offset = ctypes.c_int64()
+        units = ctypes.c_int32() # PS2000A_FS = 0 ... PS2000A_S = 5
+        self.status["getTriggerTimeOffset"] = ps.ps2000aGetTriggerTimeOffset64(self.chandle, \
+                ctypes.byref(offset), ctypes.byref(units), self.SEGMENT_INDEX)
+        assert_pico_ok(self.status["getTriggerTimeOffset"])
+        return offset.value * 10.0 ** (3 * units.value - 15)
+
+    def streaming_buffers(self):
+        for i in range(0, len(self.channels)):
+            self.status["setDataBuffers" + str(i)] = ps.ps2000aSetDataBuffers(self.chandle, i, \
+                    self.stream_buffers[i].ctypes.data_as(ctypes.POINTER(ctypes.c_int16)), None, \
+                    len(self.stream_buffers[i]), 0, 0) # segment 0, RATIO_MODE_NONE
+            assert_pico_ok(self.status["setDataBuffers" + str(i)])
+
+    def run_streaming(self, sample_interval_ns):
+        interval = ctypes.c_uint32(int(sample_interval_ns))
+        # PS2000A_NS time units, no pre trigger samples, no auto stop, no downsampling
+        self.status["runStreaming"] = ps.ps2000aRunStreaming(self.chandle, ctypes.byref(interval), 2, \
+                0, len(self.stream_buffers[0]), 0, 1, 0, len(self.stream_buffers[0]))
+        assert_pico_ok(self.status["runStreaming"])
+        self.time_interval_ns.value = interval.value
+
+    def streaming_latest_values(self):
+        self.status["getStreamingLatestValues"] = \
+                ps.ps2000aGetStreamingLatestValues(self.chandle, self.STREAMING_READY, None)
+
     def stop(self):
         ''' Stops the PicoScope. '''
         self.status["stop"] = ps.ps2000aStop(self.chandle)
@@ -0,0 +1,298 @@
+import os
+import sys
+import threading
+import time
+from acoustics import *
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Simulation'))
+from Simulation import Ping, Pinger, Hydrophone
+
+PICO_OK = 0
+PICO_INVALID_TIMEBASE = 14
+
+# Per model capture sizes and ADC resolution, matching Pico_4000a and Pico_2000a
+MODELS = {
+    4: { "pre_trigger": 20000, "post_trigger": 60000, "adc_bits": 12 },
+    2: { "pre_trigger": 3500, "post_trigger": 8500, "adc_bits": 8 },
+}
+
+class Pico_Sim(Acoustics):
+    ''' Simulated PicoScope.
+
+    Generates captures from a Simulation Ping/Pinger/Hydrophone scenario
+    instead of talking to a device, so the capture -> TDOA -> bearing path
+    can be run without a scope attached. '''
+
+    def __init__(self, num_channels = 4, delta_x = 0, delta_z = 0, model = 4):
+        self.MODEL = model if model in MODELS else 4
+        super().__init__(num_channels, delta_x, delta_z)
+        self.set_scenario()
+
+    def init_run_attributes(self):
+        self.PRE_TRIGGER_SAMPLES = MODELS[self.MODEL]["pre_trigger"]
+        self.POST_TRIGGER_SAMPLES = MODELS[self.MODEL]["post_trigger"]
+        self.MAX_SAMPLES = self.PRE_TRIGGER_SAMPLES + self.POST_TRIGGER_SAMPLES
+        self.TIME_INDISPOSED = None # milliseconds
+        self.SEGMENT_INDEX = 0
+        self.LP_READY = None # arm() calls block_ready_callback directly
+        self.P_PARAMETER = None
+        self.REALTIME = False # complete captures after the capture window instead of at once
+
+    def init_channels(self):
+        self.COUPLING_TYPE = 1 # DC
+        self.RANGE = 7 # 2V range
+        self.ANALOG_OFFSET = 0 # in volts
+        self.ENABLED = 1
+
+    def init_trigger(self):
+        self.DIRECTION = 2 # RISING
+        self.trigger_channel = 0
+        self.threshold = 0.5
+        self.auto_trigger = 0
+        self.delay = 0
+
+    def init_buffer_attributes(self):
+        self.MODE = 0 # RATIO_MODE_NONE
+        self.START_INDEX = 0
+        self.DOWNSAMPLE_RATIO = 0
+        self.DOWNSAMPLE_RATIO_MODE = 0 # RATIO_MODE_NONE
+        self.MAX_ADC = ctypes.c_int16(32767) # max ADC count value
+        self.ADC_BITS = MODELS[self.MODEL]["adc_bits"]
+
+    def init_device_variables(self):
+        self.chandle = ctypes.c_int16()
+        self.status = {}
+        self.time_interval_ns = ctypes.c_float()
+        self.returned_max_samples = ctypes.c_int32()
+
+    def set_scenario(self, pinger_location = (10, 5, -2), hydrophone_locations = None, \
+            frequency = 25000, ping_length = 4e-3, intensity = 1, noise = 0.005, period = 2):
+        '''Sets the simulated environment.
+
+        Parameters:
+            pinger_location: (x, y, z) of the pinger in meters
+            hydrophone_locations: (x, y, z) of each channel in meters,
+                defaults to a 5 cm square array
+            frequency: ping frequency in Hz, between 25000 and 40000
+            ping_length: length of the ping in seconds
+            intensity: ping amplitude at the hydrophones in volts
+            noise: standard deviation of the background noise in volts
+            period: seconds between pings when streaming
+        '''
+        if hydrophone_locations is None:
+            hydrophone_locations = [ (0.05 * (i % 2), 0.05 * ((i // 2) % 2), 0.05 * (i // 4)) \
+                    for i in range(0, len(self.channels)) ]
+        self.pinger = Pinger(pinger_location, Ping(ping_length, frequency, intensity, 0))
+        self.hydrophones = [ Hydrophone(location, None, None) for location in hydrophone_locations ]
+        self.noise = noise
+        self.ping_period = period
+
+    def set_sample_length(self, length):
+        # 4000a: sample interval = 12.5 ns * (TIMEBASE + 1)
+        # 2000a: sample interval = (TIMEBASE - 2) / 62,500,000 seconds
+        if self.MODEL == 2:
+            self.TIMEBASE = math.ceil( (length / self.MAX_SAMPLES) * 625e5) + 2
+            valid = self.TIMEBASE > 2
+            interval_ns = (self.TIMEBASE - 2) / 625e5 * 1e9
+        else:
+            self.TIMEBASE = math.floor(length / (12.5e-9 * self.MAX_SAMPLES)) - 1
+            valid = self.TIMEBASE >= 0
+            interval_ns = 12.5 * (self.TIMEBASE + 1)
+        self.status["getTimebase2"] = PICO_OK if valid else PICO_INVALID_TIMEBASE
+        assert_pico_ok(self.status["getTimebase2"])
+        self.time_interval_ns.value = interval_ns
+        self.returned_max_samples.value = self.MAX_SAMPLES
+
+    def open_unit(self):
+        self.chandle.value = 1
+        self.status["openunit"] = PICO_OK
+
+    def open_channels(self):
+        '''Creates a connection for each channel.
+
+        Goes from 0 to one less than channels size.'''
+        for i in range(0, len(self.channels)):
+            self.status["setCh" + str(i)] = PICO_OK
+
+    def set_trigger(self, trigger_channel = 0, threshold = 0.5, auto_trigger = 0, delay = 0):
+        '''Sets a sampling threshold.
+
+        Parameters:
+            trigger_channel: The channel number to watch
+            threshold: The minimum signal voltage to trigger
+            delay: samples from the trigger to the start of the post
+                trigger samples, the driver counts it in sample periods
+            auto_trigger: milliseconds to trigger without passing threshold,
+                0 waits for the threshold
+        '''
+        self.trigger_channel = trigger_channel
+        self.threshold = threshold
+        self.auto_trigger = auto_trigger
+        self.delay = delay
+        self.status["trigger"] = PICO_OK
+
+    def buffers(self):
+        '''Creates buffers to capture data.'''
+        for i in range(0, len(self.channels)):
+            self.status["setDataBuffers" + str(i)] = PICO_OK
+
+    def ping_values(self, dt):
+        ''' Returns the ping sampled every dt seconds and its arrival delay
+            in samples at each hydrophone, relative to the nearest one. '''
+
+        ping = self.pinger.ping
+        ping.set_sampling_period(dt)
+        ping.generate_ping()
+
+        distances = [ math.dist(self.pinger.location, h.location) for h in self.hydrophones ]
+        nearest = min(distances)
+        return ping.ping_values, [ round((distance - nearest) / 1480 / dt) for distance in distances ]
+
+    def quantize(self, volts):
+        ''' Converts volts to int16 counts for the channel range and the
+            model's ADC resolution. Returns the counts and overflow flags. '''
+
+        if self.noise:
+            volts = volts + np.random.normal(0, self.noise, size = volts.shape)
+        step = 2 ** (16 - self.ADC_BITS)
+        counts = np.round(volts * 1000 / CHANNEL_RANGES_MV[self.RANGE] * self.MAX_ADC.value / step) * step
+        clipped = np.abs(counts) > self.MAX_ADC.value
+        overflow = sum(1 << i for i in range(0, len(self.channels)) if clipped[i].any())
+        return np.clip(counts, -self.MAX_ADC.value, self.MAX_ADC.value).astype(np.int16), overflow
+
+    def simulate(self):
+        ''' Generates one block of int16 ADC counts, channels x samples,
+            its overflow flags and the seconds waited for the auto trigger.
+
+        The trigger channel's first rising crossing of the threshold is
+        placed at PRE_TRIGGER_SAMPLES - delay, like the scope's trigger
+        position. Without a crossing the block is only noise if
+        auto_trigger is set, otherwise there is no block and None is
+        returned, the scope would wait on. '''
+
+        ping, delays = self.ping_values(self.time_interval_ns.value * 1e-9)
+
+        # Pad on both sides so the window can be cut around the trigger point
+        length = 2 * self.MAX_SAMPLES + len(ping) + self.delay
+        start = self.MAX_SAMPLES
+        volts = np.zeros((len(self.channels), length))
+        for i, hydrophone in enumerate(self.hydrophones):
+            data = np.zeros(length)
+            data[start:start + len(ping)] = ping
+            hydrophone.set_received_data(data)
+            hydrophone.adjust_delay(delays[i])
+            volts[i] = hydrophone.received_data
+
+        crossings = np.flatnonzero((volts[self.trigger_channel][1:] > self.threshold) & \
+                (volts[self.trigger_channel][:-1] <= self.threshold))
+        if len(crossings) == 0:
+            if not self.auto_trigger:
+                return None
+            return self.quantize(np.zeros((len(self.channels), self.MAX_SAMPLES))) + (self.auto_trigger * 1e-3,)
+        first = crossings[0] + 1 + self.delay - self.PRE_TRIGGER_SAMPLES
+        return self.quantize(volts[:, first:first + self.MAX_SAMPLES]) + (0,)
+
+    def simulate_stream(self, start, count):
+        ''' Generates count samples of a continuous recording starting at
+            sample start, with a ping every ping_period seconds. '''
+
+        ping, delays = self.ping_values(self.time_interval_ns.value * 1e-9)
+        period = max(round(self.ping_period / (self.time_interval_ns.value * 1e-9)), 1)
+        volts = np.zeros((len(self.channels), count))
+        for i in range(0, len(self.channels)):
+            first = max((start - delays[i] - len(ping)) // period + 1, 0)
+            last = (start + count - 1 - delays[i]) // period
+            for k in range(first, last + 1):
+                onset = k * period + delays[i] - start
+                lo = max(onset, 0)
+                hi = min(onset + len(ping), count)
+                volts[i][lo:hi] += ping[lo - onset:hi - onset]
+        return self.quantize(volts)
+
+    def arm(self):
+        self.start_arm()
+        self.status["runBlock"] = PICO_OK
+        blocks = [ self.simulate() for i in range(0, self.num_captures) ]
+        if None in blocks:
+            # Never triggers, wait_ready() times out like it would on the scope
+            return self.block_ready
+        self.sim_counts = [ counts for counts, overflow, waited in blocks ]
+        self.sim_overflow = [ overflow for counts, overflow, waited in blocks ]
+        if self.REALTIME:
+            # Report completion from another thread after the capture window, like the driver
+            duration = self.num_captures * self.MAX_SAMPLES * self.time_interval_ns.value * 1e-9 + \
+                    sum(waited for counts, overflow, waited in blocks)
+            threading.Timer(duration, self.block_ready_callback, (self.chandle.value, PICO_OK, self.arm_generation)).start()
+        else:
+            self.block_ready_callback(self.chandle.value, PICO_OK, self.arm_generation)
+        return self.block_ready
+
+    def values_call(self):
+        counts = self.sim_counts[0]
+        ratio = self.downsample_ratio()
+        if ratio > 1:
+            # Same reductions the driver applies to each group of ratio samples
+            groups = counts[:, :(self.MAX_SAMPLES // ratio) * ratio].reshape(len(counts), -1, ratio)
+            mode = self.DOWNSAMPLE_RATIO_MODE
+            if mode == RATIO_MODES["aggregate"]:
+                counts = groups.max(axis = 2)
+                self.buffer_mins[:, :counts.shape[1]] = groups.min(axis = 2)
+            elif mode == RATIO_MODES["average"]:
+                counts = groups.mean(axis = 2)
+            else:
+                counts = groups[:, :, 0]
+        self.buffer_maxes[:, :counts.shape[1]] = counts
+        self.C_MAX_SAMPLES.value = counts.shape[1]
+        self.overflow.value = self.sim_overflow[0]
+        self.status["getValues"] = PICO_OK
+
+    def segments(self, count):
+        self.status["memorySegments"] = PICO_OK
+        self.status["setNoOfCaptures"] = PICO_OK
+
+    def segment_buffers(self):
+        for i in range(0, len(self.channels)):
+            self.status["setDataBuffers" + str(i)] = PICO_OK
+
+    def values_bulk_call(self):
+        for segment in range(0, len(self.rapid_maxes)):
+            self.rapid_maxes[segment] = self.sim_counts[segment]
+            self.rapid_overflow[segment] = self.sim_overflow[segment]
+        self.C_MAX_SAMPLES.value = self.MAX_SAMPLES
+        self.status["getValuesBulk"] = PICO_OK
+
+    def trigger_time_offset(self):
+        self.status["getTriggerTimeOffset"] = PICO_OK
+        return 0.0 # simulate() puts the trigger exactly on a sample
+
+    def streaming_buffers(self):
+        for i in range(0, len(self.channels)):
+            self.status["setDataBuffers" + str(i)] = PICO_OK
+
+    def run_streaming(self, sample_interval_ns):
+        self.time_interval_ns.value = int(sample_interval_ns)
+        self.sim_stream_position = 0
+        self.sim_stream_started = time.perf_counter()
+        self.status["runStreaming"] = PICO_OK
+
+    def streaming_latest_values(self):
+        count = len(self.stream_buffers[0])
+        if self.REALTIME:
+            # Only what the scope would have sampled by now
+            due = (time.perf_counter() - self.sim_stream_started) / (self.time_interval_ns.value * 1e-9)
+            count = min(count, int(due) - self.sim_stream_position)
+        self.status["getStreamingLatestValues"] = PICO_OK
+        if count <= 0:
+            return
+        counts, overflow = self.simulate_stream(self.sim_stream_position, count)
+        self.stream_buffers[:, :count] = counts
+        self.sim_stream_position += count
+        self.streaming_callback(self.chandle.value, count, 0, overflow, 0, 0, 0, None)
+
+    def stop(self):
+        ''' Stops the PicoScope. '''
+        self.status["stop"] = PICO_OK
+
+    def close(self):
+        ''' Closes the PicoScope. '''
+        self.status["close"] = PICO_OK
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+import numpy as np
+from capture import Capture
+
+class Pipeline:
+    ''' Runs acquisition and analysis at the same time.
+
+    The scope fills one capture buffer set while a worker thread analyzes
+    the previous one. Buffer sets go back to the scope only once their
+    analysis is done, so a slow analyze() holds up acquisition instead of
+    growing memory. '''
+
+    def __init__(self, scope, analyze, buffer_sets = 2):
+        '''
+        Parameters:
+            scope: an initialized Acoustics
+            analyze: called with a Capture on the worker thread, its return
+                values are collected by run(). The Capture borrows buffers
+                that are reused once analyze returns, keep capture.copy()
+                if it is needed later.
+            buffer_sets: capture buffer sets to cycle through
+        '''
+        self.scope = scope
+        self.analyze = analyze
+        self.free = queue.Queue()
+        for i in range(0, buffer_sets):
+            self.free.put((np.zeros_like(scope.buffer_maxes), np.zeros_like(scope.buffer_maxes, dtype = np.float32)))
+        self.full = queue.Queue(maxsize = buffer_sets)
+        self.captured = 0
+        self.analyzed = 0
+        self.elapsed = 0
+
+    def run(self, run_name, count, timeout = None):
+        '''Captures count runs named run_name_0 ... and analyzes them.
+
+        Returns the analyze() results in capture order.'''
+
+        results = []
+        errors = []
+        worker = threading.Thread(target = self.analysis_loop, args = (results, errors))
+        original = self.scope.buffer_maxes
+        start = time.perf_counter()
+        worker.start()
+        try:
+            for k in range(0, count):
+                raw, mV = self.free.get() # waits while every set is still being analyzed
+                if errors:
+                    break
+                self.scope.buffer_maxes = raw
+                self.scope.buffers()
+                self.scope.run_name = run_name + "_" + str(k)
+                self.scope.block(timeout)
+                self.scope.values_call()
+                # The Capture's views are read only, the worker converts into mV itself
+                samples = self.scope.C_MAX_SAMPLES.value
+                self.full.put((Capture(self.scope.run_name, raw[:, :samples], mV[:, :samples], \
+                        self.scope.sample_interval_ns(), self.scope.PRE_TRIGGER_SAMPLES // self.scope.downsample_ratio(), \
+                        self.scope.overflow.value), raw, mV))
+                self.captured += 1
+        finally:
+            self.full.put(None)
+            worker.join()
+            self.elapsed = time.perf_counter() - start
+            self.scope.buffer_maxes = original
+            self.scope.buffers()
+        if errors:
+            raise errors[0]
+        return results
+
+    def analysis_loop(self, results, errors):
+        ''' Worker thread, converts and analyzes captures until run() is done. '''
+
+        while True:
+            item = self.full.get()
+            if item is None:
+                return
+            capture, raw, mV = item
+            try:
+                if not errors:
+                    count = capture.raw.shape[-1]
+                    self.scope.counts_to_mV(raw[:, :count], mV[:, :count])
+                    results.append(self.analyze(capture))
+                    self.analyzed += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                self.free.put((raw, mV))
+
+    def rate(self):
+        ''' Captures per second of the last run(). '''
+        return self.captured / self.elapsed if self.elapsed else 0
@@ -0,0 +1,65 @@
+import threading
+import numpy as np
+
+class RingBuffer:
+    ''' Fixed size per-channel ring of int16 samples.
+
+    Positions are absolute sample counts since the ring was created, so a
+    window keeps its meaning after the ring wraps. A consumer marks what it
+    has used with advance(), anything overwritten before that is counted
+    in dropped. '''
+
+    def __init__(self, num_channels, capacity):
+        self.data = np.zeros((num_channels, capacity), dtype = np.int16)
+        self.capacity = capacity
+        self.written = 0 # total samples written
+        self.read_index = 0 # consumer position
+        self.dropped = 0 # samples overwritten before the consumer reached them
+        self.overflows = np.zeros(num_channels, dtype = np.int64) # over range blocks per channel
+        self.lock = threading.Lock()
+
+    def oldest(self):
+        ''' First sample position still held in the ring. '''
+        return max(self.written - self.capacity, 0)
+
+    def write(self, block, overflow = 0):
+        ''' Appends a channels x samples block.
+
+        overflow is the driver's bit mask of channels that went over range. '''
+
+        count = block.shape[-1]
+        with self.lock:
+            if count > self.capacity:
+                self.written += count - self.capacity
+                block = block[:, count - self.capacity:]
+                count = self.capacity
+
+            start = self.written % self.capacity
+            first = min(count, self.capacity - start)
+            self.data[:, start:start + first] = block[:, :first]
+            self.data[:, :count - first] = block[:, first:]
+            self.written += count
+
+            if self.read_index < self.oldest():
+                self.dropped += self.oldest() - self.read_index
+                self.read_index = self.oldest()
+            for i in range(0, len(self.overflows)):
+                if overflow & (1 << i):
+                    self.overflows[i] += 1
+
+    def window(self, start, end):
+        ''' Returns a copy of samples [start, end) as channels x samples.
+
+        Raises ValueError if part of the window is not in the ring. '''
+
+        with self.lock:
+            if start < self.oldest() or end > self.written or start > end:
+                raise ValueError("Samples " + str(start) + "-" + str(end) + " are not in the ring (" + \
+                        str(self.oldest()) + "-" + str(self.written) + ")")
+            return np.take(self.data, np.arange(start, end) % self.capacity, axis = 1)
+
+    def advance(self, position):
+        ''' Marks samples before position as used by the consumer. '''
+
+        with self.lock:
+            self.read_index = max(self.read_index, min(position, self.written))
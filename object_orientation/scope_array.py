@@ -0,0 +1,79 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+class ScopeArray:
+    ''' Several scopes acquiring as one hydrophone array.
+
+    Every scope is armed on its own thread so the captures run in parallel,
+    then the captures are aligned on their trigger times and merged into
+    one channel matrix. The scopes have to share a trigger event, for
+    example the same hydrophone or an external trigger wired to all of
+    them. '''
+
+    def __init__(self, scopes):
+        self.scopes = scopes
+        self.executor = ThreadPoolExecutor(max_workers = len(scopes))
+        # Merge onto the finest sample grid
+        self.reference = 0
+
+    def each(self, function, *args):
+        ''' Calls function(scope, *args) on every scope in parallel, returns the results in order. '''
+        futures = [ self.executor.submit(function, scope, *args) for scope in self.scopes ]
+        return [ future.result() for future in futures ]
+
+    def initialize(self, trigger_channel = 0, sample_length = 0.1, threshold = 0.5, auto_trigger = 0, delay = 0):
+        '''Sets up every scope, see Acoustics.initialize.'''
+
+        self.each(lambda scope: scope.initialize(trigger_channel, sample_length, threshold, auto_trigger, delay))
+        intervals = [ scope.sample_interval_ns() for scope in self.scopes ]
+        self.reference = intervals.index(min(intervals))
+
+    def run(self, run_name, timeout = None):
+        '''Collects one capture from every scope at the same time.
+
+        Returns the merged channels x samples mV matrix, also kept in merged.'''
+
+        self.run_name = run_name
+        self.each(lambda scope: scope.run(run_name, timeout))
+        self.offsets = [ scope.trigger_time_offset() for scope in self.scopes ]
+        self.merged = self.merge()
+        return self.merged
+
+    def merge(self):
+        ''' Lines up the last captures on their trigger times and stacks
+            their channels, scope by scope, on the reference scope's grid. '''
+
+        # Time of every sample in seconds, the trigger event is t = 0
+        times = []
+        for scope, offset in zip(self.scopes, self.offsets):
+            dt = scope.run_interval_ns * 1e-9
+            trigger = scope.run_trigger_index
+            times.append((np.arange(0, scope.C_MAX_SAMPLES.value) - trigger) * dt - offset)
+
+        dt = self.scopes[self.reference].run_interval_ns * 1e-9
+        start = max(t[0] for t in times)
+        end = min(t[-1] for t in times)
+        grid = start + np.arange(0, int(np.floor((end - start) / dt)) + 1) * dt
+
+        channels = []
+        for scope, t in zip(self.scopes, times):
+            same_grid = np.isclose(t[1] - t[0], dt) and np.isclose((t[0] - start) / dt, round((t[0] - start) / dt))
+            for channel in scope.adc_2mV_maxes:
+                if same_grid:
+                    first = int(round((start - t[0]) / dt))
+                    channels.append(channel[first:first + len(grid)])
+                else:
+                    channels.append(np.interp(grid, t, channel).astype(np.float32))
+        return np.stack(channels)
+
+    def time_difference_matrix(self, weighting = None, max_lag = None):
+        ''' All-pairs TDOA over the merged channels, see Acoustics.time_difference_matrix. '''
+        return self.scopes[self.reference].time_difference_matrix(self.merged, weighting, max_lag)
+
+    def toda_to_time(self, toda):
+        return self.scopes[self.reference].toda_to_time(toda, self.merged.shape[-1])
+
+    def end(self):
+        ''' Shuts down every scope. '''
+        self.each(lambda scope: scope.end())
+        self.executor.shutdown()
@@ -0,0 +1,223 @@
+#!/bin/python3
+
+''' Long running acquisition service.
+
+The server opens the PicoScope once and keeps it open. Clients connect
+over a Unix socket, so tools start without loading picosdk or scipy and
+several of them can share one device handle.
+
+Protocol: every request is one line of JSON, {"command": ..., ...}.
+Every reply is one line of JSON followed by "size" bytes of payload.
+Captures send the int16 ADC counts as a channels x samples C ordered
+array, the header says how to turn them into mV. A failed request
+replies {"error": ...}. '''
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import numpy as np
+from capture import Capture
+
+DEFAULT_SOCKET = "/tmp/acoustics_scope.sock"
+
+# Capture settings a client can change, with the initialize() defaults
+SETTINGS = {"trigger_channel": 0, "sample_length": 5e-3, "threshold": 0.5, "auto_trigger": 0, "delay": 0}
+
+class ScopeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    ''' Serves captures from one open scope to any number of clients.
+
+    Requests from different clients are taken one at a time, the device
+    only ever sees one caller. '''
+
+    daemon_threads = True
+
+    def __init__(self, scope, path = DEFAULT_SOCKET, settings = None):
+        self.scope = scope
+        self.path = path
+        self.lock = threading.Lock()
+        self.settings = dict(SETTINGS)
+        self.settings.update(settings or {})
+        self.captures = 0
+        scope.initialize(**self.settings)
+
+        if os.path.exists(path):
+            os.unlink(path)
+        super().__init__(path, ScopeHandler)
+
+    def dispatch(self, request):
+        ''' Runs one request, returns the reply header and payload bytes. '''
+
+        command = request.get("command")
+        with self.lock:
+            if command == "configure":
+                return self.configure(request), b""
+            if command == "capture":
+                return self.capture(request)
+            if command == "status":
+                return self.status(), b""
+        raise ValueError("Unknown command " + repr(command))
+
+    def configure(self, request):
+        ''' Changes the capture settings in place, the unit stays open.
+
+        Settings left out of the request keep their current value. If the
+        driver rejects the new settings the previous ones are applied again. '''
+
+        settings = dict(self.settings)
+        for name in SETTINGS:
+            if name in request:
+                settings[name] = request[name]
+        if settings != self.settings:
+            try:
+                self.scope.configure(**settings)
+            except Exception:
+                # The driver may have taken some of the new settings before failing
+                self.scope.configure(**self.settings)
+                raise
+            self.settings = settings
+        return self.status()
+
+    def capture(self, request):
+        self.scope.run(request.get("run_name", str(self.captures)), request.get("timeout"))
+        self.captures += 1
+        raw = np.ascontiguousarray(self.scope.buffer_maxes[:, :self.scope.C_MAX_SAMPLES.value])
+        header = {
+            "run_name": self.scope.run_name,
+            "shape": raw.shape,
+            "dtype": "int16",
+            "time_interval_ns": self.scope.run_interval_ns,
+            "trigger_index": self.scope.run_trigger_index,
+            "overflow": self.scope.overflow.value,
+            "mV_per_count": self.scope.counts_to_mV(np.ones(1, dtype = np.int16))[0].item(),
+        }
+        return header, raw.tobytes()
+
+    def status(self):
+        return {
+            "model": type(self.scope).__name__,
+            "num_channels": len(self.scope.channels),
+            "max_samples": self.scope.MAX_SAMPLES,
+            "time_interval_ns": self.scope.sample_interval_ns(),
+            "captures": self.captures,
+            "settings": self.settings,
+        }
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class ScopeHandler(socketserver.StreamRequestHandler):
+    ''' One client connection, answers requests until the client hangs up. '''
+
+    def handle(self):
+        try:
+            for line in self.rfile:
+                try:
+                    header, payload = self.server.dispatch(json.loads(line))
+                except Exception as e:
+                    self.reply({"error": type(e).__name__ + ": " + str(e), "size": 0})
+                    continue
+                header["size"] = len(payload)
+                self.reply(header, payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass # the client hung up, its reply has nowhere to go
+
+    def reply(self, header, payload = None):
+        ''' Sends one reply header line and its payload. '''
+        self.wfile.write(json.dumps(header).encode() + b"\n")
+        if payload:
+            self.wfile.write(payload)
+        self.wfile.flush()
+
+class ScopeClient:
+    ''' Connection to a running ScopeServer.
+
+    Only needs numpy, so it is quick to import from analysis tools. '''
+
+    def __init__(self, path = DEFAULT_SOCKET):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+
+    def request(self, command, **arguments):
+        ''' Sends one request, returns the reply header and payload.
+
+        Raises RuntimeError with the server's message if the request failed. '''
+
+        arguments["command"] = command
+        self.file.write(json.dumps(arguments).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Scope server closed the connection")
+        header = json.loads(line)
+        payload = self.file.read(header.pop("size"))
+        if "error" in header:
+            raise RuntimeError(header["error"])
+        return header, payload
+
+    def configure(self, **settings):
+        ''' Changes capture settings, see Acoustics.configure. Returns the server status. '''
+        return self.request("configure", **settings)[0]
+
+    def status(self):
+        return self.request("status")[0]
+
+    def capture(self, run_name = None, timeout = None):
+        ''' Takes one block on the server's scope and returns it as a Capture. '''
+
+        arguments = {"timeout": timeout}
+        if run_name is not None:
+            arguments["run_name"] = run_name
+        header, payload = self.request("capture", **arguments)
+        raw = np.frombuffer(payload, dtype = header["dtype"]).reshape(header["shape"])
+        return Capture(header["run_name"], raw, None, header["time_interval_ns"], header["trigger_index"], \
+                header["overflow"], header["mV_per_count"])
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Keeps a PicoScope open and serves captures over a Unix socket.")
+    parser.add_argument("--model", type = int, default = 4, help = "4 or 2, 0 for simulated")
+    parser.add_argument("--sim-model", type = int, default = 4, help = "model the simulator imitates")
+    parser.add_argument("--channels", type = int, default = 4)
+    parser.add_argument("--socket", default = DEFAULT_SOCKET)
+    for name, default in SETTINGS.items():
+        parser.add_argument("--" + name.replace("_", "-"), type = type(default), default = default)
+    args = parser.parse_args()
+
+    if args.model == 2:
+        from pico_2000a import Pico_2000a
+        scope = Pico_2000a(args.channels)
+    elif args.model == 0:
+        from pico_sim import Pico_Sim
+        scope = Pico_Sim(args.channels, model = args.sim_model)
+    else:
+        from pico_4000a import Pico_4000a
+        scope = Pico_4000a(args.channels)
+
+    server = ScopeServer(scope, args.socket, { name: getattr(args, name) for name in SETTINGS })
+    print("Serving " + type(scope).__name__ + " on " + args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        scope.end()
+
+if __name__ == "__main__":
+    sys.exit(main())
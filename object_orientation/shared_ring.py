@@ -0,0 +1,191 @@
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from capture import Capture
+
+# Per slot capture metadata, stored in shared memory ahead of the samples
+SLOT_META = np.dtype([
+    ("sequence", np.int64), # 2 * capture number + 2 once written, odd while being written
+    ("samples", np.int64), # valid samples per channel
+    ("time_interval_ns", np.float64),
+    ("trigger_index", np.int64),
+    ("overflow", np.int64),
+    ("mV_per_count", np.float64),
+    ("run_name", "S64"),
+])
+# slots, channels, samples, captures published
+HEADER = np.dtype((np.int64, 4))
+ALIGN = 64
+
+class SharedRing:
+    ''' Ring of capture slots in a multiprocessing.shared_memory block.
+
+    The acquisition process publishes every capture into the next slot,
+    worker processes attach by name and read the slots in place, so the
+    samples are never pickled or copied between processes.
+
+    Each slot carries a sequence number, written odd before the samples
+    change and even after. A reader checks it before and after using a
+    slot to know the capture it used was not overwritten meanwhile. '''
+
+    def __init__(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        self.header = np.ndarray((), dtype = HEADER, buffer = memory.buf)
+        self.slots, num_channels, samples, _ = self.header
+        meta_offset = ALIGN
+        data_offset = meta_offset + -(-self.slots * SLOT_META.itemsize // ALIGN) * ALIGN
+        self.meta = np.ndarray(self.slots, dtype = SLOT_META, buffer = memory.buf, offset = meta_offset)
+        self.data = np.ndarray((self.slots, num_channels, samples), dtype = np.int16, \
+                buffer = memory.buf, offset = data_offset)
+
+    @classmethod
+    def create(cls, num_channels, samples, slots = 8, name = None):
+        ''' Allocates a new ring, the creating process owns and unlinks it. '''
+
+        meta_size = -(-slots * SLOT_META.itemsize // ALIGN) * ALIGN
+        size = ALIGN + meta_size + slots * num_channels * samples * np.dtype(np.int16).itemsize
+        memory = shared_memory.SharedMemory(name = name, create = True, size = size)
+        header = np.ndarray((), dtype = HEADER, buffer = memory.buf)
+        header[...] = (slots, num_channels, samples, 0)
+        ring = cls(memory, True)
+        ring.meta[:] = np.zeros(1, dtype = SLOT_META)
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        ''' Opens a ring created by another process. '''
+
+        memory = shared_memory.SharedMemory(name = name)
+        # Only the creator unlinks. Pool workers share their parent's resource
+        # tracker, an unrelated process has its own that would remove the block on exit.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(memory._name, "shared_memory")
+        return cls(memory, False)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def published(self):
+        ''' Number of captures written so far. '''
+        return int(self.header[3])
+
+    def sequence(self, number):
+        return 2 * number + 2
+
+    def write(self, raw, run_name = "", time_interval_ns = 0, trigger_index = 0, overflow = 0, mV_per_count = 0):
+        ''' Copies a channels x samples int16 capture into the next slot.
+
+        Returns the capture number to hand to readers. '''
+
+        number = self.published
+        slot = number % self.slots
+        meta = self.meta[slot]
+        meta["sequence"] = self.sequence(number) - 1
+        count = raw.shape[-1]
+        self.data[slot, :, :count] = raw
+        meta["samples"] = count
+        meta["time_interval_ns"] = time_interval_ns
+        meta["trigger_index"] = trigger_index
+        meta["overflow"] = overflow
+        meta["mV_per_count"] = mV_per_count
+        meta["run_name"] = str(run_name).encode()[:SLOT_META["run_name"].itemsize]
+        meta["sequence"] = self.sequence(number)
+        self.header[3] = number + 1
+        return number
+
+    def publish(self, scope):
+        ''' Writes the scope's last run, see Acoustics.run. '''
+
+        return self.write(scope.buffer_maxes[:, :scope.C_MAX_SAMPLES.value], scope.run_name, \
+                scope.run_interval_ns, scope.run_trigger_index, \
+                scope.overflow.value, scope.counts_to_mV(np.ones(1, dtype = np.int16))[0])
+
+    def valid(self, number):
+        ''' True while capture number is still in its slot. '''
+        return self.meta[number % self.slots]["sequence"] == self.sequence(number)
+
+    def read(self, number):
+        ''' Returns capture number as a Capture.
+
+        The Capture borrows the shared slot, raw is a view of it that
+        changes when the slot is reused, keep capture.copy() if needed
+        later. adc_2mV is converted in this process when first used.
+        Raises ValueError if the capture has been overwritten, check
+        valid() again after using raw. '''
+
+        slot = number % self.slots
+        meta = self.meta[slot].copy()
+        if meta["sequence"] != self.sequence(number):
+            raise ValueError("Capture " + str(number) + " is no longer in the ring")
+        raw = self.data[slot, :, :meta["samples"]]
+        capture = Capture(meta["run_name"].decode(), raw, None, float(meta["time_interval_ns"]), \
+                int(meta["trigger_index"]), int(meta["overflow"]), float(meta["mV_per_count"]))
+        if not self.valid(number):
+            raise ValueError("Capture " + str(number) + " was overwritten while reading")
+        return capture
+
+    def close(self):
+        ''' Detaches from the ring, the owner also frees it. '''
+
+        del self.header, self.meta, self.data
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+# The ring and analysis function of a pool worker, set by worker_init
+worker_ring = None
+worker_analyze = None
+
+def worker_init(name, analyze):
+    global worker_ring, worker_analyze
+    worker_ring = SharedRing.attach(name)
+    worker_analyze = analyze
+
+def worker_run(number):
+    capture = worker_ring.read(number)
+    result = worker_analyze(capture)
+    if not worker_ring.valid(number):
+        raise ValueError("Capture " + str(number) + " was overwritten during analysis")
+    return result
+
+class SharedRingPool:
+    ''' Analyzes captures from a SharedRing on a pool of worker processes.
+
+    analyze is called with a Capture in a worker and must be picklable,
+    a module level function. At most slots - 1 captures are waiting or
+    being analyzed at once, acquisition waits for the oldest before it
+    would overwrite a slot still in use. '''
+
+    def __init__(self, ring, analyze, processes = None):
+        self.ring = ring
+        self.pool = multiprocessing.Pool(processes, worker_init, (ring.name, analyze))
+
+    def submit(self, number):
+        ''' Starts analysis of capture number, returns its AsyncResult. '''
+        return self.pool.apply_async(worker_run, (number,))
+
+    def run(self, scope, run_name, count, timeout = None):
+        '''Captures count runs named run_name_0 ... and analyzes them in the pool.
+
+        Returns the analyze() results in capture order.'''
+
+        pending = []
+        for k in range(0, count):
+            for result in pending[:max(len(pending) - self.ring.slots + 2, 0)]:
+                result.wait()
+            scope.run(run_name + "_" + str(k), timeout)
+            pending.append(self.submit(self.ring.publish(scope)))
+        return [ result.get() for result in pending ]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
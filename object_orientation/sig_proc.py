@@ -0,0 +1,259 @@
+import functools
+import math
+import numpy as np
+
+SPEED_OF_SOUND = 1480 # m/s in water
+
+PINGER_BAND = (25000, 40000) # Hz, the pinger frequencies of Simulation.Ping
+
+WEIGHTINGS = ("plain", "phat", "scot")
+WHITEN_RANGE = 1e-6 # of the peak cross spectrum magnitude, weight treats weaker bins as this
+SCOT_BINS = 9 # frequency bins the SCOT auto spectra are averaged over
+
+def aperture_lag(aperture, tstep, speed = SPEED_OF_SOUND):
+    ''' Largest physically possible delay, in samples, between two
+        hydrophones that are aperture meters apart. '''
+
+    return math.ceil(aperture / speed / tstep)
+
+def weight(cross, spectrum_one, spectrum_two, weighting = "plain"):
+    ''' Applies a GCC weighting to a cross spectrum.
+
+        plain: unweighted cross correlation
+        phat: phase transform, whitens to unit magnitude
+        scot: smoothed coherence transform, divides by the geometric mean
+            of the two auto spectra averaged over SCOT_BINS bins
+
+        Bins more than WHITEN_RANGE below the strongest are not whitened,
+        after a bandpass they only hold rounding noise. '''
+
+    if weighting == "plain":
+        return cross
+    floor = np.maximum(np.abs(cross).max(axis = -1, keepdims = True) * WHITEN_RANGE, np.finfo(np.float64).tiny)
+    if weighting == "phat":
+        return cross / np.maximum(np.abs(cross), floor)
+    if weighting == "scot":
+        # Unsmoothed, sqrt(|X1|^2 |X2|^2) is |X1 X2*| and SCOT would be PHAT
+        from scipy import ndimage
+        power = ndimage.uniform_filter1d(np.abs(spectrum_one) ** 2, SCOT_BINS, axis = -1, mode = "nearest") * \
+                ndimage.uniform_filter1d(np.abs(spectrum_two) ** 2, SCOT_BINS, axis = -1, mode = "nearest")
+        # The running sum of the filter can leave tiny negative bins, clamp before the sqrt
+        return cross / np.maximum(np.sqrt(np.maximum(power, 0)), floor)
+    raise ValueError("Unknown weighting " + str(weighting) + ", expected one of " + str(WEIGHTINGS))
+
+def fft_length(length_one, length_two, max_lag = None):
+    ''' FFT size that keeps every lag up to max_lag free of circular wrap. '''
+
+    from scipy import fft # scipy is imported on first use, see acoustics
+    if max_lag is None:
+        return fft.next_fast_len(length_one + length_two - 1, real = True)
+    return fft.next_fast_len(max(length_one, length_two) + max_lag, real = True)
+
+def peak_index(correlation, length_one, length_two, max_lag = None):
+    ''' Finds the correlation peak of a circular correlation along the last axis.
+
+        Returns the index in full cross correlation order, the same as
+        np.argmax(signal.correlate(one, two, mode='full')), so zero lag is
+        at length_two - 1. '''
+
+    n = correlation.shape[-1]
+    positive = length_one - 1
+    negative = length_two - 1
+    if max_lag is not None:
+        positive = min(positive, max_lag)
+        negative = min(negative, max_lag)
+
+    window = np.concatenate((correlation[..., n - negative:], correlation[..., :positive + 1]), axis = -1)
+    return np.argmax(window, axis = -1) - negative + length_two - 1
+
+def gcc(channel_one, channel_two, weighting = "plain", max_lag = None):
+    ''' Generalized cross correlation time difference using the FFT.
+
+        Parameters:
+            channel_one, channel_two: sampled channels
+            weighting: "plain", "phat" or "scot"
+            max_lag: largest lag in samples to search, None searches all
+
+        Returns the peak index in full cross correlation order (NOT time). '''
+
+    from scipy import fft
+    channel_one = np.asarray(channel_one, dtype = np.float64)
+    channel_two = np.asarray(channel_two, dtype = np.float64)
+    n = fft_length(len(channel_one), len(channel_two), max_lag)
+
+    spectrum_one = fft.rfft(channel_one, n)
+    spectrum_two = fft.rfft(channel_two, n)
+    cross = weight(spectrum_one * np.conj(spectrum_two), spectrum_one, spectrum_two, weighting)
+
+    return int(peak_index(fft.irfft(cross, n), len(channel_one), len(channel_two), max_lag))
+
+def gcc_matrix(channels, weighting = "plain", max_lag = None):
+    ''' All-pairs generalized cross correlation.
+
+        Each channel is transformed once and the spectra are reused for
+        every pair. Only pairs i < j are correlated, (j, i) is the mirror
+        of (i, j).
+
+        Returns an N x N matrix of peak indices in full cross correlation
+        order, entry (i, j) is gcc(channels[i], channels[j]). '''
+
+    from scipy import fft
+    channels = np.asarray(channels, dtype = np.float64)
+    count, length = channels.shape
+    n = fft_length(length, length, max_lag)
+
+    spectra = fft.rfft(channels, n, axis = -1)
+    one, two = np.triu_indices(count, 1)
+    cross = weight(spectra[one] * np.conj(spectra[two]), spectra[one], spectra[two], weighting)
+    peaks = peak_index(fft.irfft(cross, n, axis = -1), length, length, max_lag)
+
+    matrix = np.full((count, count), length - 1, dtype = np.int64) # zero lag on the diagonal
+    matrix[one, two] = peaks
+    matrix[two, one] = 2 * (length - 1) - peaks
+    return matrix
+
+def detect_pings(channels, ping_detect, noise_length):
+    ''' Finds every ping on every channel in one pass.
+
+        A ping starts at the first sample whose rectified envelope is above
+        ping_detect and ends once noise_length samples pass without going
+        above it again, the same hang rule as PingDetector.end_ping.
+
+        Returns a list per channel of (start, end) sample indices, end is
+        one past the last sample above ping_detect. '''
+
+    envelope = np.abs(np.atleast_2d(channels))
+    channel, index = np.nonzero(envelope > ping_detect)
+
+    # A new run starts on a new channel or after a gap of noise_length
+    new = np.ones(len(index), dtype = bool)
+    new[1:] = (channel[1:] != channel[:-1]) | (np.diff(index) >= noise_length)
+    starts = np.flatnonzero(new)
+    ends = np.append(starts[1:], len(index))[:len(starts)] - 1
+
+    pings = [ [] for i in range(0, len(envelope)) ]
+    for c, start, end in zip(channel[starts], index[starts], index[ends] + 1):
+        pings[c].append((int(start), int(end)))
+    return pings
+
+class PingTracker:
+    ''' detect_pings for a signal that arrives in consecutive pieces.
+
+        The ping in progress is carried from one piece to the next, so a
+        ping split across pieces is found once with the same start and end
+        detect_pings would give on the whole signal. '''
+
+    def __init__(self, ping_detect, noise_length):
+        self.ping_detect = ping_detect
+        self.noise_length = noise_length
+        self.start = None # ping in progress
+        self.last = None # last sample above ping_detect
+        self.position = 0 # samples seen
+
+    def update(self, envelope):
+        ''' Takes the next piece of a 1-D rectified envelope.
+
+            Returns the (start, end) absolute sample positions of the pings
+            that are known to be over, end is one past the last sample
+            above ping_detect. '''
+
+        done = []
+        loud = np.flatnonzero(envelope > self.ping_detect) + self.position
+        self.position += len(envelope)
+        if len(loud):
+            if self.start is not None and loud[0] - self.last >= self.noise_length:
+                done.append((self.start, self.last + 1))
+                self.start = None
+            if self.start is None:
+                self.start = int(loud[0])
+            for split in np.flatnonzero(np.diff(loud) >= self.noise_length):
+                done.append((self.start, int(loud[split]) + 1))
+                self.start = int(loud[split + 1])
+            self.last = int(loud[-1])
+        if self.start is not None and self.position - self.last >= self.noise_length:
+            done.append((self.start, self.last + 1))
+            self.start = None
+        return done
+
+    def flush(self):
+        ''' Ends the signal, returns the ping still in progress if any. '''
+
+        done = [(self.start, self.last + 1)] if self.start is not None else []
+        self.start = None
+        return done
+
+def dominant_frequency(channels, tstep):
+    ''' Frequency in Hz of the largest spectral peak of each channel. '''
+
+    from scipy import fft
+    channels = np.atleast_2d(channels)
+    magnitude = np.abs(fft.rfft(channels, axis = -1))
+    return fft.rfftfreq(channels.shape[-1], d = tstep)[np.argmax(magnitude, axis = -1)]
+
+def decimation(tstep, band):
+    ''' Samples per block of band_frequency, a decimated rate of 4x the band width. '''
+    return max(int(1 / (tstep * 4 * (band[1] - band[0]))), 1)
+
+@functools.lru_cache(maxsize = 16)
+def band_tables(length, tstep, band, bins):
+    ''' Mixer tables, decimation factor, bin frequencies and DFT matrix for band_frequency. '''
+
+    low, high = band
+    center = (low + high) / 2
+    width = high - low
+    # The block mean attenuates the band edges by under 3 %
+    factor = decimation(tstep, band)
+    usable = length // factor * factor
+    # Real and imaginary parts apart, mixing real samples then needs no complex temporary
+    angle = (-2 * np.pi * center * tstep) * np.arange(0, usable).reshape(-1, factor)
+    mixer = (np.cos(angle).astype(np.float32) / factor, np.sin(angle).astype(np.float32) / factor)
+
+    if bins is None:
+        bins = int(math.ceil(2 * width * usable * tstep)) + 1 # twice the natural resolution
+    bins = max(bins, 2)
+    spacing = width / (bins - 1)
+    # Two extra bins past each edge so a peak on the edge can still be interpolated
+    offsets = (np.arange(-2, bins + 2) * spacing - width / 2)
+    times = (np.arange(0, usable // factor) * factor + (factor - 1) / 2) * tstep
+    dft = np.exp(-2j * np.pi * np.outer(times, offsets)).astype(np.complex64)
+    return mixer, factor, center + offsets, dft
+
+def band_frequency(channels, tstep, band = PINGER_BAND, bins = None):
+    ''' Dominant frequency of each channel within band, in Hz.
+
+        Zoom DFT: the band is mixed down to 0 Hz, low passed and decimated
+        by a block mean, and only the bins inside the band are evaluated,
+        by a small cached DFT matrix. A parabola through the peak bin and
+        its neighbours refines the estimate below the bin spacing. Windows
+        shorter than one decimation block take the largest full FFT bin
+        inside band, NaN when no bin is inside.
+
+        Parameters:
+            channels: one channel or channels x samples, e.g. a ping window
+            tstep: sample interval in seconds
+            band: (low, high) Hz to search
+            bins: frequencies evaluated across the band, by default twice
+                the 1 / duration resolution of the full FFT
+        '''
+
+    channels = np.atleast_2d(channels)
+    if channels.shape[-1] < decimation(tstep, band):
+        # Shorter than one block, e.g. a single noise sample over ping_detect
+        from scipy import fft
+        frequencies = fft.rfftfreq(channels.shape[-1], d = tstep)
+        inside = (frequencies >= band[0]) & (frequencies <= band[1])
+        if not inside.any():
+            return np.full(len(channels), np.nan)
+        magnitude = np.abs(fft.rfft(channels, axis = -1))[:, inside]
+        return frequencies[inside][np.argmax(magnitude, axis = -1)]
+    (cos, sin), factor, frequencies, dft = band_tables(channels.shape[-1], float(tstep), tuple(band), bins)
+    blocks = channels[:, :cos.size].reshape(len(channels), -1, factor)
+    baseband = np.einsum("cbf,bf->cb", blocks, cos) + 1j * np.einsum("cbf,bf->cb", blocks, sin)
+    magnitude = np.abs(baseband @ dft)
+
+    peak = np.argmax(magnitude[:, 2:-2], axis = -1) + 2
+    rows = np.arange(0, len(channels))
+    left, centre, right = magnitude[rows, peak - 1], magnitude[rows, peak], magnitude[rows, peak + 1]
+    curve = left - 2 * centre + right
+    shift = np.where(curve < 0, 0.5 * (left - right) / np.where(curve < 0, curve, -1), 0)
+    return frequencies[peak] + np.clip(shift, -0.5, 0.5) * (frequencies[1] - frequencies[0])
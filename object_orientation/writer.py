@@ -0,0 +1,119 @@
+import collections
+import queue
+import threading
+import time
+import capture_file
+
+class Writer:
+    ''' Saves captures and plots on background threads.
+
+    The acquisition thread only snapshots what is to be written and queues
+    it, the disk writes happen on the writer threads. The queue is
+    bounded: when storage falls that far behind, submit() waits for room,
+    or drops the write if drop_when_full is set. '''
+
+    def __init__(self, max_pending = 16, threads = 1, drop_when_full = False):
+        self.queue = queue.Queue(maxsize = max_pending)
+        self.drop_when_full = drop_when_full
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.errors = []
+        self.latencies = collections.deque(maxlen = 100) # (queued, writing) seconds of recent writes
+        self.threads = [ threading.Thread(target = self.write_loop, daemon = True) for i in range(0, threads) ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, *args):
+        ''' Queues function(*args) for a writer thread.
+
+        The arguments must not change after the call, pass copies.
+        Returns False if the write was dropped. '''
+
+        try:
+            self.queue.put((function, args, time.perf_counter()), block = not self.drop_when_full)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def write_capture(self, scope):
+        ''' Queues the scope's last run as a capture file, returns its path. '''
+
+        path = scope.output_path(capture_file.EXTENSION)
+        self.submit(capture_file.write, path, scope.buffer_maxes[:, :scope.C_MAX_SAMPLES.value].copy(), \
+                scope.capture_header())
+        return path
+
+    def write_plot(self, fig, path):
+        ''' Queues saving a matplotlib Figure, see Acoustics.time_figure. '''
+        self.submit(fig.savefig, path)
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            function, args, queued = item
+            start = time.perf_counter()
+            try:
+                function(*args)
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(e)
+            finally:
+                end = time.perf_counter()
+                with self.lock:
+                    self.written += 1
+                    self.latencies.append((start - queued, end - start))
+                self.queue.task_done()
+
+    def stats(self):
+        ''' Queue depth and latency of recent writes, in seconds. '''
+
+        with self.lock:
+            latencies = list(self.latencies)
+            stats = {
+                "depth": self.queue.qsize(),
+                "max_depth": self.max_depth,
+                "written": self.written,
+                "dropped": self.dropped,
+                "errors": len(self.errors),
+            }
+        stats["queued_latency"] = max([ queued for queued, writing in latencies ], default = 0)
+        stats["write_latency"] = sum([ writing for queued, writing in latencies ]) / len(latencies) if latencies else 0
+        stats["max_write_latency"] = max([ writing for queued, writing in latencies ], default = 0)
+        return stats
+
+    def flush(self):
+        ''' Waits until everything queued is written.
+
+        Raises the first write error since the last flush. '''
+
+        self.queue.join()
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        ''' Flushes and stops the writer threads. '''
+
+        try:
+            self.flush()
+        finally:
+            for thread in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -3,8 +3,6 @@
 import readline
 import sys
 sys.path.append('object_orientation/')
-from pico_4000a import Pico_4000a
-from pico_2000a import Pico_2000a
 
 try:
     num_channels = int(input("Number of channels: "))
@@ -14,70 +12,104 @@ except ValueError:
 run = 1
 
 try:
-    model = int(input("Model (4 or 2): "))
+    model = int(input("Model (4 or 2, 0 for simulated): "))
     if model == 2:
+        from pico_2000a import Pico_2000a
         scope = Pico_2000a(num_channels)
+    elif model == 0:
+        from pico_sim import Pico_Sim
+        scope = Pico_Sim(num_channels, model = int(input("Simulated model (4 or 2): ") or 4))
     else:
+        from pico_4000a import Pico_4000a
         scope = Pico_4000a(num_channels)
 except ValueError:
+    from pico_2000a import Pico_2000a
     scope = Pico_2000a(num_channels)
 
-while True:
-    try:
-        trigger_channel = int(input("Trigger channel: "))
-    except ValueError:
-        trigger_channel = 0
-    try:
-        sample_length = float(input("Sample Length (s): "))
-    except ValueError:
-        sample_length = 5e-3
-    try:
-        trigger_threshold = float(input("Trigger threshold (Volts): "))
-    except ValueError:
-        trigger_threshold = 0.5
-    try:
-        auto_trigger = int(input("Auto Trigger: "))
-    except ValueError:
-        auto_trigger = 0
+# Files are written in the background so the next run is not held up
+from writer import Writer
+writer = Writer()
+# Every run is indexed for later queries, see object_orientation/archive.py
+from archive import Archive
+archive = Archive()
 
-    print("Initializing...")
-    scope.initialize(trigger_channel, sample_length, trigger_threshold, auto_trigger)
+# Close in finally so Ctrl-C still flushes the queued captures and plots
+try:
     while True:
         try:
-            batch_size = int(input("Batch num: "))
+            trigger_channel = int(input("Trigger channel: "))
+        except ValueError:
+            trigger_channel = 0
+        try:
+            sample_length = float(input("Sample Length (s): "))
+        except ValueError:
+            sample_length = 5e-3
+        try:
+            trigger_threshold = float(input("Trigger threshold (Volts): "))
         except ValueError:
-            batch_size = 1
-        name = input("Run name: ")
-        # Number from 1, when no name is provided
-        if name == '':
-            name = str(run)
-            run += 1
-            print("Run #" + name)
-        count = 0
-        while count < int(batch_size):
-            batch_name = name + "_" + str(count)
-            print("Batch Run: " + batch_name)
-            print("Running...")
-            scope.run(batch_name)
-            print("Analyzing...")
-            scope.write_csv()
-            scope.print_fourier()
-            scope.print_toda()
-            print("Plotting...")
+            trigger_threshold = 0.5
+        try:
+            auto_trigger = int(input("Auto Trigger: "))
+        except ValueError:
+            auto_trigger = 0
+        scope.crop_to_ping = input("Crop analysis to the ping? (y/N): ") in ("y","Y")
+        write_csv = input("Also write CSV? (y/N): ") in ("y","Y")
+
+        print("Initializing...")
+        scope.initialize(trigger_channel, sample_length, trigger_threshold, auto_trigger)
+        while True:
+            try:
+                batch_size = int(input("Batch num: "))
+            except ValueError:
+                batch_size = 1
+            name = input("Run name: ")
+            # Number from 1, when no name is provided
+            if name == '':
+                name = str(run)
+                run += 1
+                print("Run #" + name)
+            if batch_size > 1:
+                # One arm and one transfer for the whole batch
+                print("Running batch of " + str(batch_size) + "...")
+                scope.run_rapid(name, batch_size)
+            count = 0
+            while count < int(batch_size):
+                batch_name = name + "_" + str(count)
+                print("Batch Run: " + batch_name)
+                if batch_size > 1:
+                    scope.load_segment(count, batch_name)
+                else:
+                    print("Running...")
+                    scope.run(batch_name)
+                print("Analyzing...")
+                path = writer.write_capture(scope)
+                if write_csv:
+                    scope.write_csv()
+                frequencies = scope.print_fourier()
+                delays = scope.print_toda()
+                archive.record(scope, path, frequencies, delays)
+                print("Plotting...")
+
+                writer.write_plot(scope.time_figure(), scope.output_path("_time.png"))
+                writer.write_plot(scope.freq_figure(), scope.output_path("_freq.png"))
 
-            scope.plot_time()
-            scope.write_plot("time")
-            scope.show_plot()
+                scope.plot_time()
+                scope.show_plot()
 
-            scope.plot_freq()
-            scope.write_plot("freq")
-            scope.show_plot()
+                scope.plot_freq()
+                scope.show_plot()
 
-            count = count + 1
-        run_again = input("Run again? (Y/n): ")
-        if run_again in ("n","N"):
+                count = count + 1
+            stats = writer.stats()
+            print("Writer: " + str(stats["depth"]) + " queued, " + str(stats["written"]) + " written, " + \
+                    "%.3f s average write" % stats["write_latency"])
+            run_again = input("Run again? (Y/n): ")
+            if run_again in ("n","N"):
+                break
+        scope.close()
+        change_params = input("Change initialization parameters? (Y/n): ")
+        if change_params in ("n","N"):
             break
-    scope.close()
-    change_params = input("Change initialization parameters? (Y/n): ")
-    if change_params in ("n","N"):
-        break
+finally:
+    writer.close()
+    archive.close()
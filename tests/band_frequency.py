@@ -0,0 +1,51 @@
+import os
+import sys
+import numpy as np
+
+# Regression checks for sig_proc.band_frequency. Run from anywhere: python tests/band_frequency.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'object_orientation'))
+import chunked
+import sig_proc
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%-40s %s" % (name, "ok" if ok else "FAILED"))
+
+# A tone is found to well under the full FFT bin spacing
+tstep = 125e-9
+t = np.arange(0, 80000) * tstep
+tone = np.sin(2 * np.pi * 33333.3 * t)
+check("tone frequency", abs(sig_proc.band_frequency(tone, tstep)[0] - 33333.3) < 5)
+
+# Windows shorter than a decimation block, down to one sample, at 62.5 ns and 1 us
+for step in (62.5e-9, 1e-6):
+    for length in (1, 2, sig_proc.decimation(step, sig_proc.PINGER_BAND) - 1, sig_proc.decimation(step, sig_proc.PINGER_BAND)):
+        try:
+            result = sig_proc.band_frequency(np.ones((2, length)), step)
+            inside = (result >= sig_proc.PINGER_BAND[0]) & (result <= sig_proc.PINGER_BAND[1])
+            ok = result.shape == (2,) and np.all(inside | np.isnan(result))
+        except Exception as e:
+            ok = False
+        check("%d samples at %g s" % (length, step), ok)
+
+# Short windows only search the full FFT bins inside the band, a stronger tone below it is ignored
+short = np.arange(0, 265) * 62.5e-9
+window = np.sin(2 * np.pi * 60000 * short) + 3 * np.sin(2 * np.pi * 120000 * short)
+result = sig_proc.band_frequency(window, 62.5e-9, (50000, 65000))[0]
+check("short window stays in band", 50000 <= result <= 65000)
+check("short window without a bin in band", np.isnan(sig_proc.band_frequency(window, 62.5e-9)[0]))
+
+# A single noise sample over ping_detect makes a 1 sample ping in ChunkedAnalysis
+raw = np.zeros((2, 200000), dtype = np.float32)
+raw[:, 1000] = 100
+raw[:, 100000:108000] = 100 * np.sin(2 * np.pi * 30000 * np.arange(0, 8000) * tstep)
+try:
+    pings = list(chunked.ChunkedAnalysis(raw, tstep * 1e9, chunk_samples = 50000).pings())
+    ok = len(pings) == 2 and pings[0].end - pings[0].start == 1
+except Exception as e:
+    ok = False
+check("1 sample ping in ChunkedAnalysis", ok)
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,30 @@
+import os
+import sys
+import numpy as np
+
+# Regression checks for the ChunkedAnalysis filters. Run from anywhere: python tests/chunked_filter.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'object_orientation'))
+import chunked
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%-40s %s" % (name, "ok" if ok else "FAILED"))
+
+# A ping in the last samples of the recording, shorter than the bandpass delay
+tstep = 62.5e-9
+raw = np.zeros((2, 200000), dtype = np.float32)
+raw[:, -1500:] = 100 * np.sin(2 * np.pi * 30000 * np.arange(0, 1500) * tstep)
+
+seen = []
+def prefilter(chunk):
+    seen.append(chunk.shape[-1])
+    return chunk
+
+analysis = chunked.ChunkedAnalysis(raw, tstep * 1e9, chunk_samples = 50000, prefilter = prefilter, filter_band = (25000, 40000))
+pings = list(analysis.pings())
+check("prefilter kept with filter_band", sum(seen) == raw.shape[-1])
+check("bandpass tail flushed", len(pings) == 1 and pings[0].end == raw.shape[-1])
+
+sys.exit(1 if failed else 0)
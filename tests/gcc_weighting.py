@@ -0,0 +1,47 @@
+import os
+import sys
+import warnings
+import numpy as np
+
+# Regression checks for the GCC weightings in sig_proc. Run from anywhere: python tests/gcc_weighting.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'object_orientation'))
+import sig_proc
+from scipy import fft
+
+failed = False
+def check(name, ok):
+    global failed
+    failed = failed or not ok
+    print("%-40s %s" % (name, "ok" if ok else "FAILED"))
+
+# Band limited noise, every bin outside 25-40 kHz exactly zero, the second channel 37 samples late.
+# The delay is circular so no edge leaks energy outside the band.
+tstep = 125e-9
+length = 20000
+spectrum = fft.rfft(np.random.default_rng(0).normal(size = length))
+frequencies = fft.rfftfreq(length, tstep)
+spectrum[(frequencies < 25000) | (frequencies > 40000)] = 0
+signal = fft.irfft(spectrum, length) * 1e6
+channels = np.array([ signal, np.roll(signal, 37) ])
+
+for weighting in sig_proc.WEIGHTINGS:
+    spectra = fft.rfft(channels, axis = -1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            weighted = sig_proc.weight(spectra[0] * np.conj(spectra[1]), spectra[0], spectra[1], weighting)
+            finite = bool(np.isfinite(weighted).all())
+            lag = sig_proc.gcc_matrix(channels, weighting, 100)[1, 0] - (length - 1)
+        except Exception as e:
+            finite = False
+            lag = None
+    check(weighting + " finite on band limited input", finite)
+    if weighting == "plain":
+        # phat and scot whiten the leakage the zero padding adds outside the band, only plain is exact here
+        check(weighting + " lag", lag == 37)
+
+spectra = fft.rfft(channels, axis = -1)
+check("scot differs from phat", not np.allclose(sig_proc.weight(spectra[0] * np.conj(spectra[1]), spectra[0], spectra[1], "scot"), \
+        sig_proc.weight(spectra[0] * np.conj(spectra[1]), spectra[0], spectra[1], "phat")))
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+# Import time budget in seconds for each module, and modules it must not pull in
+# at import. Run from anywhere: python tests/import_time.py
+BUDGETS = {
+    "capture": (0.3, ["scipy", "matplotlib", "picosdk"]),
+    "sig_proc": (0.3, ["scipy", "matplotlib", "picosdk"]),
+    "acoustics": (0.4, ["scipy", "matplotlib", "picosdk", "tkinter"]),
+    "pico_sim": (0.4, ["scipy", "matplotlib", "picosdk", "tkinter"]),
+    "matched_filter": (0.3, ["scipy", "matplotlib", "picosdk"]),
+    "fir": (0.3, ["scipy", "matplotlib", "picosdk"]),
+    "scope_server": (0.3, ["scipy", "matplotlib", "picosdk", "acoustics"]),
+}
+RUNS = 3
+
+source = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'object_orientation')
+probe = "import sys, time; sys.path.insert(0, %r); start = time.perf_counter(); import %s; " \
+        "print(time.perf_counter() - start); print(' '.join(sorted(sys.modules)))"
+
+failed = False
+for module, (budget, forbidden) in BUDGETS.items():
+    times = []
+    for i in range(0, RUNS):
+        output = subprocess.run([sys.executable, "-c", probe % (source, module)], \
+                capture_output = True, text = True, check = True).stdout.splitlines()
+        times.append(float(output[0]))
+    loaded = set(output[1].split())
+    pulled = [ name for name in forbidden if name in loaded ]
+    best = min(times)
+    ok = best <= budget and not pulled
+    failed = failed or not ok
+    print("%-14s %6.3f s (budget %.3f s) %s" % (module, best, budget, "ok" if ok else "OVER BUDGET"), \
+            "imported " + ", ".join(pulled) if pulled else "")
+
+sys.exit(1 if failed else 0)